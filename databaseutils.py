@@ -6,12 +6,26 @@ from datetime import datetime, date
 from datetime import timedelta
 import pandas
 import numpy as np
-from os import path
+from os import path, makedirs, replace
+import argparse
+import time
+import sys
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import csv
+from decimal import Decimal
+import json
+import re
 import xlsxwriter
 
 STONEEDGE_DB = 'C:/Stoneedge/SEOrdman.mdb'
 SQL_DB = 'DRIVER={SQL Server Native Client 11.0};SERVER=CADILLAC;Trusted_Connection=yes;'
 ##SQL_DB = 'Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ='+STONEEDGE_DB
+ACCESS_DB = 'Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ='+STONEEDGE_DB
+SQLITE_DB = 'Driver={SQLite3 ODBC Driver};Database='
 
 def workDaysDiff(start, end):
     daysDelta = (end-start).days
@@ -51,25 +65,1271 @@ def getStationDays(row):
         colNum += 1
     return(workDaysDiff(scanTime.date(), curTime.date()),colName, colNum)
 
+
+STATION_COLUMNS = ['Engraving','Welding','PC/Paint','Paint Fill','Packaging']
+STATUS_REPORT_COLUMNS = ['SKU','Sets','Days','Ordered','Ship By','Status'] + \
+                        STATION_COLUMNS + ['Customer']
+
+def workDaysDiffArray(start, end):
+    #Vectorized workDaysDiff over arrays of dates
+    start = np.asarray(start, dtype='datetime64[D]')
+    end = np.asarray(end, dtype='datetime64[D]')
+    daysDelta = (end-start).astype(np.int64)
+    hangDays = daysDelta % 7
+    weeks = daysDelta // 7
+    wrap = hangDays >= 5
+    return(np.where(wrap, hangDays-7, hangDays) + 5*(weeks+wrap))
+
+
+def getStationDaysArray(report, today = None):
+    #Vectorized getStationDays: returns work days at the current station
+    #and the report column number of that station for every row
+    if today is None:
+        today = datetime.now().date()
+    scanTime = pandas.to_datetime(report['Ordered']).to_numpy(dtype='datetime64[ns]')
+    colNum = np.full(len(report), 6)
+    for i, station in enumerate(STATION_COLUMNS):
+        stamp = pandas.to_datetime(report[station]).to_numpy(dtype='datetime64[ns]')
+        later = (stamp > scanTime) | (np.isnat(scanTime) & ~np.isnat(stamp))
+        scanTime = np.where(later, stamp, scanTime)
+        colNum = np.where(later, 7+i, colNum)
+    scanned = ~np.isnat(scanTime)
+    staticDays = np.zeros(len(report), dtype=np.int64)
+    staticDays[scanned] = workDaysDiffArray(scanTime[scanned], np.datetime64(today, 'D'))
+    return(staticDays, colNum)
+
+
+SUMMARY_ROWS = ['Orders','Items','Sets','Sales']
+SUMMARY_COLUMNS = ['Backordered','Late','Percent Late']
+
+def percentOf(part, whole):
+    #An empty pipeline has nothing late
+    if not whole:
+        return(0.0)
+    return(part*100/whole)
+
+def iterStatusRecords(frame, indexLabel = 'Line'):
+    #Yields one JSON/CSV ready dict per row, dates as ISO strings
+    columns = [indexLabel] + list(frame.columns)
+    for index, values in zip(frame.index, frame.itertuples(index=False, name=None)):
+        record = {}
+        for column, value in zip(columns, (index,) + values):
+            if pandas.isna(value):
+                value = None
+            elif isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, np.generic):
+                value = value.item()
+            elif isinstance(value, Decimal):
+                value = float(value)
+            record[column] = value
+        yield record
+
+
+def isNumber(value):
+    return(isinstance(value, (int, float, Decimal, np.number)) and
+           not isinstance(value, (bool, np.bool_)))
+
+
+def numericColumns(frame):
+    #pyarrow rejects object columns mixing pyodbc Decimals with ints and
+    #floats, so all-number object columns become float64 as they do in
+    #iterStatusRecords. Other columns are left alone
+    frame = frame.copy()
+    for column in frame.columns:
+        values = frame[column]
+        if values.dtype != object:
+            continue
+        present = values[values.notna()]
+        if len(present) and present.map(isNumber).all():
+            frame[column] = values.map(lambda value: None if pandas.isna(value) else float(value)).astype(np.float64)
+    return(frame)
+
+
+def writeStatusReport(frame, filePath, fmt = 'ndjson', indexLabel = 'Line', chunkRows = 1000):
+    #Written to a temporary file and renamed, like writeCheckpoint, so a
+    #wallboard polling filePath never reads half a report. Parquet needs
+    #pyarrow and gets row groups of chunkRows
+    if fmt not in ('csv', 'ndjson', 'parquet'):
+        raise ValueError("Unknown status report format: " + str(fmt))
+    tmpPath = filePath + '.tmp'
+    if fmt == 'parquet':
+        table = numericColumns(frame.rename_axis(indexLabel).reset_index())
+        table.to_parquet(tmpPath, index = False, row_group_size = chunkRows)
+    else:
+        with open(tmpPath, 'w', newline = '') as outFile:
+            if fmt == 'csv':
+                writer = csv.DictWriter(outFile, fieldnames = [indexLabel] + list(frame.columns))
+                writer.writeheader()
+                write = writer.writerow
+            else:
+                write = lambda record: outFile.write(json.dumps(record) + '\n')
+            for record in iterStatusRecords(frame, indexLabel):
+                write(record)
+    replace(tmpPath, filePath)
+    return(filePath)
+
+
+def writeStatusSheet(workbook, worksheet, report, today = None):
+    #Highlighting is precomputed as column masks and applied while each row
+    #is written once, in order, so rendering is linear and streamable
+    plain = {'header': {'bold':True,'border':1,'align':'center','valign':'top'},
+             'notice': {'border':3},
+             'alert': {'bold':True,'font_color':'red','border':1}}
+    numFormats = {'': {}, 'date': {'num_format':'mm/dd/yy'},
+                  'datetime': {'num_format':'m/dd hh:mm'}}
+    formats = {}
+    for kind, numFormat in numFormats.items():
+        formats[kind, None] = workbook.add_format(numFormat) if numFormat else None
+        for level in ('notice', 'alert'):
+            formats[kind, level] = workbook.add_format(dict(plain[level], **numFormat))
+    headerFormat = workbook.add_format(plain['header'])
+
+    kinds = []
+    for column in report.columns:
+        if column in ('Ordered', 'Ship By'):
+            kinds.append('date')
+        elif column in STATION_COLUMNS:
+            kinds.append('datetime')
+        else:
+            kinds.append('')
+
+    days = pandas.to_numeric(report['Days']).to_numpy(dtype=float)
+    daysLevel = np.where(days < 0, 'alert', np.where(days == 0, 'notice', ''))
+    shipByLevel = np.where(report['Ship By'].isna().to_numpy(), 'notice', '')
+    staticDays, stationCol = getStationDaysArray(report, today)
+    stationLevel = np.where(staticDays > 1, 'alert', np.where(staticDays == 1, 'notice', ''))
+    daysCol = report.columns.get_loc('Days')+1
+    shipByCol = report.columns.get_loc('Ship By')+1
+
+    for col, name in enumerate(report.columns):
+        worksheet.write(0, col+1, name, headerFormat)
+
+    values = report.to_numpy(dtype=object)
+    for i in range(len(report)):
+        levels = {daysCol: daysLevel[i], shipByCol: shipByLevel[i],
+                  stationCol[i]: stationLevel[i]}
+        worksheet.write(i+1, 0, report.index[i], headerFormat)
+        for col, value in enumerate(values[i]):
+            cellFormat = formats[kinds[col], levels.get(col+1) or None]
+            if pandas.isna(value):
+                worksheet.write_blank(i+1, col+1, None, cellFormat)
+            else:
+                worksheet.write(i+1, col+1, value, cellFormat)
+
+
+SKU_FAMILY_LENGTH = 5
+
+def skuFamily(sku):
+    return(str(sku)[:SKU_FAMILY_LENGTH])
+
+
+def skuMatchClause(sku, column = 'SKU', dialect = None):
+    #Sargable form of "SKU = ? OR SUBSTRING(SKU, 1, 5) = ?"
+    #A family prefix becomes a LIKE range seek, anything else an equality seek
+    sku = str(sku)
+    if len(sku) == SKU_FAMILY_LENGTH:
+        if dialect is None:
+            dialect = SQLServerDialect()
+        return(dialect.like_prefix(column, sku))
+    return(column + ' = ?', sku)
+
+
+class SkuCatalog:
+    #In-memory view of Inventory keyed by SKU, family prefix and category
+    def __init__(self, rows = ()):
+        self.skus = {}
+        self.families = {}
+        self.categories = {}
+        self.discontinued = {}
+        self.stale = set()
+        for row in rows:
+            self.update(row.LocalSKU, row.Discontinued, row.Category)
+
+    def __contains__(self, sku):
+        return(sku in self.skus)
+
+    def __len__(self):
+        return(len(self.skus))
+
+    def update(self, sku, discontinued, category):
+        self.remove(sku)
+        discontinued = bool(discontinued) or (category == "MTO")
+        self.skus[sku] = (discontinued, category)
+        self.families.setdefault(skuFamily(sku), {})[sku] = None
+        self.categories.setdefault(category, {})[sku] = None
+        if discontinued:
+            self.discontinued[sku] = None
+        self.stale.discard(sku)
+
+    def remove(self, sku):
+        if sku not in self.skus:
+            return
+        discontinued, category = self.skus.pop(sku)
+        self.families[skuFamily(sku)].pop(sku, None)
+        self.categories[category].pop(sku, None)
+        self.discontinued.pop(sku, None)
+
+    def invalidate(self, sku):
+        self.stale.add(sku)
+
+    def family(self, prefix):
+        return(list(self.families.get(skuFamily(prefix), ())))
+
+    def category(self, category, active = True):
+        skus = self.categories.get(category, ())
+        if active:
+            return([sku for sku in skus if sku not in self.discontinued])
+        return(list(skus))
+
+    def is_discontinued(self, sku):
+        return(sku in self.discontinued)
+
+    def lists(self):
+        #Same partition as Database.get_sku_lists
+        return(self.category('FGPN'), self.category('Base'), list(self.discontinued))
+
+
+INVENTORY_NUMERIC_COLUMNS = ['QOH', 'Price', 'Price2', 'Price3', 'Price4', 'Price5', 'Price6',
+                             'Price7', 'Price8', 'Price9', 'Price10', 'RetailPrice',
+                             'Length', 'Width', 'Height', 'MAP']
+INVENTORY_TEXT_COLUMNS = ['LocalSKU', 'ItemName', 'Location', 'Text5', 'Image',
+                          'Description', 'UPC']
+
+class StringColumn:
+    #Strings packed into one UTF-8 buffer with row offsets, so a column
+    #can be saved as plain arrays and memory-mapped by other processes
+    def __init__(self, data, offsets, nulls):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        nulls = np.array([value is None for value in values], dtype=bool)
+        return(cls(data, offsets, nulls))
+
+    def __len__(self):
+        return(len(self.nulls))
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return(None)
+        return(self.data[self.offsets[i]:self.offsets[i+1]].tobytes().decode('utf-8'))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, rows):
+        return(StringColumn.from_values([self[i] for i in rows]))
+
+
+class InventorySnapshot:
+    #Column-oriented copy of the active inventory. Numeric and price fields
+    #are float arrays (NaN for NULL), Category is stored as codes into an
+    #interned category list and text fields as StringColumns
+    def __init__(self, numeric, text, categoryCodes, categories, discontinued):
+        self.numeric = numeric
+        self.text = text
+        self.categoryCodes = categoryCodes
+        self.categories = [sys.intern(category) if category is not None else None
+                           for category in categories]
+        self.discontinued = discontinued
+        self.index = {}
+        for i, sku in enumerate(self.text['LocalSKU']):
+            self.index[sys.intern(sku)] = i
+
+    @classmethod
+    def from_cursor(cls, cursor, chunkRows = 5000):
+        #Consumes an executed cursor in chunks so full pyodbc Rows never pile up
+        columns = [column[0] for column in cursor.description]
+        values = dict((column, []) for column in columns)
+        while True:
+            rows = cursor.fetchmany(chunkRows)
+            if not rows:
+                break
+            for row in rows:
+                for column, value in zip(columns, row):
+                    values[column].append(value)
+
+        numeric = {}
+        for column in INVENTORY_NUMERIC_COLUMNS:
+            if column in values:
+                numeric[column] = np.array([np.nan if value is None else float(value)
+                                            for value in values[column]], dtype=np.float64)
+        text = {}
+        for column in INVENTORY_TEXT_COLUMNS:
+            if column in values:
+                text[column] = StringColumn.from_values(values[column])
+
+        categories = []
+        codeLookup = {}
+        codes = np.empty(len(values['LocalSKU']), dtype=np.int32)
+        for i, category in enumerate(values.get('Category', [None]*len(codes))):
+            if category not in codeLookup:
+                codeLookup[category] = len(categories)
+                categories.append(category)
+            codes[i] = codeLookup[category]
+        discontinued = np.array([bool(value) for value in
+                                 values.get('Discontinued', [False]*len(codes))], dtype=bool)
+        return(cls(numeric, text, codes, categories, discontinued))
+
+    def __len__(self):
+        return(len(self.discontinued))
+
+    def __contains__(self, sku):
+        return(sku in self.index)
+
+    def column(self, name):
+        if name in self.numeric:
+            return(self.numeric[name])
+        if name == 'Category':
+            return([self.categories[code] for code in self.categoryCodes])
+        if name == 'Discontinued':
+            return(self.discontinued)
+        return(list(self.text[name]))
+
+    def get(self, sku, name):
+        i = self.index[sku]
+        if name in self.numeric:
+            return(self.numeric[name][i])
+        if name == 'Category':
+            return(self.categories[self.categoryCodes[i]])
+        if name == 'Discontinued':
+            return(bool(self.discontinued[i]))
+        return(self.text[name][i])
+
+    def row(self, sku):
+        #Same shape as one value of Database.get_inventory_dict
+        i = self.index[sku]
+        result = {}
+        for name, column in self.text.items():
+            result[name] = column[i]
+        for name, column in self.numeric.items():
+            value = column[i]
+            result[name] = None if np.isnan(value) else float(value)
+        result['Category'] = self.categories[self.categoryCodes[i]]
+        result['Discontinued'] = bool(self.discontinued[i])
+        return(result)
+
+    def category_mask(self, category):
+        if category not in self.categories:
+            return(np.zeros(len(self), dtype=bool))
+        return(self.categoryCodes == self.categories.index(category))
+
+    def rows_for(self, skuList):
+        return(np.array([self.index[sku] for sku in skuList], dtype=np.int64))
+
+    def select(self, mask):
+        #New snapshot holding only the rows selected by a boolean mask or row array
+        rows = np.arange(len(self))[mask]
+        numeric = dict((name, column[rows]) for name, column in self.numeric.items())
+        text = dict((name, column.take(rows)) for name, column in self.text.items())
+        return(InventorySnapshot(numeric, text, self.categoryCodes[rows],
+                                 self.categories, self.discontinued[rows]))
+
+    def update_prices(self, columns, factor = 1.0, offset = 0.0, mask = None, decimals = 2):
+        #Vectorized price change: price*factor + offset over the masked rows.
+        #A snapshot loaded with mmapMode='r' must be loaded 'c' or 'r+' first
+        if isinstance(columns, str):
+            columns = [columns]
+        if mask is None:
+            mask = slice(None)
+        for name in columns:
+            column = self.numeric[name]
+            column[mask] = np.round(column[mask]*factor + offset, decimals)
+
+    def save(self, directory):
+        if not path.isdir(directory):
+            makedirs(directory)
+        for name, column in self.numeric.items():
+            np.save(path.join(directory, name+'.npy'), column)
+        for name, column in self.text.items():
+            np.save(path.join(directory, name+'.data.npy'), column.data)
+            np.save(path.join(directory, name+'.offsets.npy'), column.offsets)
+            np.save(path.join(directory, name+'.nulls.npy'), column.nulls)
+        np.save(path.join(directory, 'Category.npy'), self.categoryCodes)
+        np.save(path.join(directory, 'Discontinued.npy'), self.discontinued)
+        meta = {'numeric': list(self.numeric),
+                'text': list(self.text),
+                'categories': self.categories}
+        with open(path.join(directory, 'snapshot.json'), 'w') as metaFile:
+            json.dump(meta, metaFile)
+        return(directory)
+
+    @classmethod
+    def load(cls, directory, mmapMode = 'r'):
+        #Arrays are memory-mapped so worker processes share one page cache copy
+        with open(path.join(directory, 'snapshot.json')) as metaFile:
+            meta = json.load(metaFile)
+        load = lambda name: np.load(path.join(directory, name+'.npy'), mmap_mode=mmapMode)
+        numeric = dict((name, load(name)) for name in meta['numeric'])
+        text = dict((name, StringColumn(load(name+'.data'), load(name+'.offsets'),
+                                        load(name+'.nulls')))
+                    for name in meta['text'])
+        return(cls(numeric, text, load('Category'), meta['categories'], load('Discontinued')))
+
+
+def lineSales(quantityShipped, quantityReturned, pricePerUnit, costPerUnit):
+    #Units, gross and net for one Order Details line, as getSalesRecord counts them
+    netSale = (quantityShipped - quantityReturned)
+    try:
+        gross = (pricePerUnit) * netSale
+    except TypeError:
+        gross = 0
+    try:
+        net = (pricePerUnit - costPerUnit) * netSale
+    except TypeError:
+        net = 0
+    return(netSale, gross, net)
+
+
+def rankSales(salesDict, total):
+    #ABCD rank by share of total units sold, ties share a rank
+    rankDict = {}
+    rankTally = 0
+    batchNum = 0
+    currentRank = "A"
+    rankLevels = {"A":0.25,
+                  "B":0.5,
+                  "C":0.75,
+                  "D":1}
+    sortedDict = [(k, salesDict[k]) for k in sorted(salesDict, key=salesDict.get, reverse=True)]
+    for sku, num in sortedDict:
+        #Computer completely filled with bees
+        if batchNum == num:
+            rankDict[sku] = currentRank
+        else:
+            batchNum = num
+            for rank in sorted(rankLevels):
+                if rankTally <= (total*rankLevels[rank]):
+                    rankDict[sku] = rank
+                    currentRank = rank
+                    break
+        rankTally += num
+    return(rankDict)
+
+
+def isMidnight(value):
+    #Plain dates compare as midnight in SQL
+    return(not isinstance(value, datetime) or value.time() == datetime.min.time())
+
+
+class SalesRollup:
+    #Units, gross and net per SKU per day. Window totals come from per-SKU
+    #prefix sums, so a query costs O(SKUs * log days) regardless of how
+    #many order lines fall in the window. Windows are whole days, see totals
+    def __init__(self):
+        self.daily = {}
+        self.families = {}
+        self.prefix = {}
+        self.lastDetailDate = None
+
+    def __len__(self):
+        return(len(self.daily))
+
+    def add(self, sku, detailDate, units, gross, net):
+        day = detailDate.toordinal()
+        skuDays = self.daily.get(sku)
+        if skuDays is None:
+            skuDays = self.daily[sku] = {}
+            self.families.setdefault(skuFamily(sku), set()).add(sku)
+        totals = skuDays.setdefault(day, [0, 0.0, 0.0])
+        totals[0] += units
+        totals[1] += float(gross)
+        totals[2] += float(net)
+        self.prefix.pop(sku, None)
+        if not isinstance(detailDate, datetime):
+            detailDate = datetime.combine(detailDate, datetime.min.time())
+        if self.lastDetailDate is None or detailDate > self.lastDetailDate:
+            self.lastDetailDate = detailDate
+
+    def clear_since(self, day):
+        #Drops every day >= day so it can be re-aggregated from the source
+        day = day.toordinal()
+        for sku, skuDays in self.daily.items():
+            stale = [d for d in skuDays if d >= day]
+            for d in stale:
+                del skuDays[d]
+            if stale:
+                self.prefix.pop(sku, None)
+
+    def _prefix(self, sku):
+        sums = self.prefix.get(sku)
+        if sums is None:
+            skuDays = self.daily.get(sku, {})
+            days = np.array(sorted(skuDays), dtype=np.int64)
+            values = np.array([skuDays[d] for d in days], dtype=np.float64).reshape(-1, 3)
+            cumulative = np.zeros((len(days)+1, 3))
+            cumulative[1:] = np.cumsum(values, axis=0)
+            sums = self.prefix[sku] = (days, cumulative)
+        return(sums)
+
+    def skus_for(self, sku):
+        #Same matching as getSalesRecord: exact SKU, or a five character family
+        if len(str(sku)) == SKU_FAMILY_LENGTH:
+            return(self.families.get(str(sku), set()) | ({sku} if sku in self.daily else set()))
+        return({sku} if sku in self.daily else set())
+
+    def totals(self, sku, startDate = None, daysDelta = 90, endDate = None):
+        #(units, gross, net) for endDate < DetailDate < startDate, matching
+        #getSalesRecord exactly when both bounds are at midnight. A bound with
+        #a time of day counts its whole day, in for startDate and out for
+        #endDate, since the rollup does not keep times. A line stamped exactly
+        #at a midnight endDate is counted here but not by getSalesRecord
+        if startDate is None:
+            startDate = datetime.today()
+        if endDate is None and daysDelta is not None:
+            endDate = startDate - timedelta(days=daysDelta)
+        hi = startDate.toordinal() - (1 if isMidnight(startDate) else 0)
+        lo = None
+        if endDate is not None:
+            lo = endDate.toordinal() - (1 if isMidnight(endDate) else 0)
+        result = np.zeros(3)
+        for match in self.skus_for(sku):
+            days, cumulative = self._prefix(match)
+            top = np.searchsorted(days, hi, side='right')
+            bottom = 0 if lo is None else np.searchsorted(days, lo, side='right')
+            result += cumulative[top] - cumulative[bottom]
+        return(int(round(result[0])), float(result[1]), float(result[2]))
+
+    def sales_record(self, skuList, startDate = None, daysDelta = 90, endDate = None):
+        #Rollup equivalent of Database.getSalesRecord
+        if isinstance(skuList, str): skuList = [skuList]
+        if isinstance(skuList, int): skuList = [skuList]
+        salesDict = {}
+        incomeDict = {}
+        total = 0
+        for sku in skuList:
+            units, gross, net = self.totals(sku, startDate, daysDelta, endDate)
+            total += units
+            salesDict[sku] = units
+            incomeDict[sku] = (gross, net)
+        return(salesDict, rankSales(salesDict, total), incomeDict)
+
+    def velocity(self, skuList, windows = (30, 60, 90, 365), startDate = None):
+        #One sales_record per window, all from the same rollup
+        return(dict((days, self.sales_record(skuList, startDate, days)) for days in windows))
+
+    def save(self, filePath):
+        skus = []
+        days = []
+        values = []
+        for sku, skuDays in self.daily.items():
+            for day, totals in skuDays.items():
+                skus.append(sku)
+                days.append(day)
+                values.append(totals)
+        skuNames = list(self.daily)
+        skuCodes = dict((sku, i) for i, sku in enumerate(skuNames))
+        np.savez(filePath,
+                 skus = np.array(skuNames, dtype=object).astype(str),
+                 codes = np.array([skuCodes[sku] for sku in skus], dtype=np.int32),
+                 days = np.array(days, dtype=np.int64),
+                 values = np.array(values, dtype=np.float64).reshape(-1, 3),
+                 lastDetailDate = np.array([self.lastDetailDate.isoformat()
+                                            if self.lastDetailDate else '']))
+        return(filePath)
+
+    @classmethod
+    def load(cls, filePath):
+        rollup = cls()
+        with np.load(filePath) as data:
+            skuNames = list(data['skus'])
+            for code, day, totals in zip(data['codes'], data['days'], data['values']):
+                sku = str(skuNames[code])
+                skuDays = rollup.daily.get(sku)
+                if skuDays is None:
+                    skuDays = rollup.daily[sku] = {}
+                    rollup.families.setdefault(skuFamily(sku), set()).add(sku)
+                skuDays[int(day)] = [int(totals[0]), float(totals[1]), float(totals[2])]
+            lastDetailDate = str(data['lastDetailDate'][0])
+        if lastDetailDate:
+            rollup.lastDetailDate = datetime.fromisoformat(lastDetailDate)
+        else:
+            days = [day for skuDays in rollup.daily.values() for day in skuDays]
+            if days:
+                rollup.lastDetailDate = datetime.fromordinal(max(days))
+        return(rollup)
+
+
+#Change events published by Database write methods once their transaction commits
+StatusChanged = namedtuple('StatusChanged', ['orderNumber', 'itemNumber', 'status', 'initials'])
+NoteInserted = namedtuple('NoteInserted', ['orderNumber', 'itemNumber', 'event', 'note'])
+InventoryUpdated = namedtuple('InventoryUpdated', ['sku', 'fields'])
+ImageChanged = namedtuple('ImageChanged', ['sku', 'image'])
+OrderShipped = namedtuple('OrderShipped', ['orderNumber', 'skuList'])
+OrderCreated = namedtuple('OrderCreated', ['orderNumber', 'sourceOrderNumber', 'numItems'])
+ItemDeleted = namedtuple('ItemDeleted', ['orderNumber', 'itemNumber'])
+
+
+class EventBus:
+    #Minimal in-process publish/subscribe. Any object with publish(event)
+    #can be handed to Database in its place
+    def __init__(self):
+        self.subscribers = {}
+
+    def subscribe(self, callback, eventType = None):
+        #eventType None receives every event
+        self.subscribers.setdefault(eventType, []).append(callback)
+        return(callback)
+
+    def unsubscribe(self, callback, eventType = None):
+        try:
+            self.subscribers.get(eventType, []).remove(callback)
+        except ValueError:
+            pass
+
+    def publish(self, event):
+        callbacks = self.subscribers.get(type(event), []) + self.subscribers.get(None, [])
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as err:
+                print("Event subscriber failed on "+type(event).__name__+": "+repr(err))
+
+
+
+ORDER_TOTALS_SQL = """
+SELECT Customers.Company, Customers.PriceLevel, Customers.Text5 AS IncomeStream, [Order Details].OrderNumber, Orders.ProductTotal, Orders.Discount, Sum(Orders.ShippingTotal) AS ShippingTotal, Orders.FinalProductTotal, Orders.RevisedDiscount, Sum(Orders.FinalShippingTotal) AS FinalShippingTotal, Sum([Order Details].QuantityShipped) AS QuantityShipped, Sum([Order Details].QuantityReturned) AS QuantityReturned, Orders.OrderDate
+FROM ((Orders INNER JOIN [Order Details] ON Orders.OrderNumber = [Order Details].OrderNumber) INNER JOIN Inventory ON [Order Details].SKU = Inventory.LocalSKU) INNER JOIN Customers ON Orders.CustomerID = Customers.CustomerID
+WHERE (Orders.OrderDate>=? AND [Order Details].Adjustment=?) AND (Inventory.Category=? OR Inventory.Category=? OR Inventory.Category=? OR Inventory.Category=?){0}
+GROUP BY Customers.Company, Customers.PriceLevel, Customers.Text5, [Order Details].OrderNumber, Orders.ProductTotal, Orders.Discount, Orders.FinalProductTotal, Orders.RevisedDiscount, Orders.OrderDate;
+"""
+
+ORDER_TOTAL_FIELDS = ['ProductTotal', 'Discount', 'ShippingTotal', 'FinalProductTotal',
+                      'RevisedDiscount', 'FinalShippingTotal', 'QuantityShipped', 'QuantityReturned']
+CUSTOMER_DATA_FIELDS = ['Gross Sale', 'Gross Discount', 'Gross Shipping', 'Net Sale',
+                        'Net Discount', 'Net Shipping', 'QuantityShipped', 'QuantityReturned']
+OrderTotal = namedtuple('OrderTotal', ['Company', 'PriceLevel', 'IncomeStream', 'OrderNumber'] +
+                        ORDER_TOTAL_FIELDS + ['OrderDate'])
+CustomerTotal = namedtuple('CustomerTotal', ['Company', 'PriceLevel', 'IncomeStream'] +
+                           [field.replace(' ', '') for field in CUSTOMER_DATA_FIELDS])
+
+class CustomerRollup:
+    #Per-order totals (the getOrderTotals rows) plus running sums per customer
+    #per calendar month. Replacing an order only touches its month bucket, so
+    #customer queries cost customers * months rather than orders
+    def __init__(self):
+        self.orders = {}
+        self.monthly = {}
+        self.priceLevels = {}
+        self.dirty = set()
+        self.lastOrderNumber = 0
+        self.lastReconciled = None
+
+    def __len__(self):
+        return(len(self.orders))
+
+    def _bucket(self, order):
+        orderDate = order.OrderDate
+        return((order.Company, order.PriceLevel, order.IncomeStream),
+               (orderDate.year, orderDate.month))
+
+    def put(self, order):
+        order = OrderTotal(*order)
+        self.remove(order.OrderNumber)
+        self.orders[order.OrderNumber] = order
+        values = np.array([float(getattr(order, field) or 0) for field in ORDER_TOTAL_FIELDS])
+        bucket = self.monthly.setdefault(self._bucket(order), [0, np.zeros(len(ORDER_TOTAL_FIELDS))])
+        bucket[0] += 1
+        bucket[1] += values
+        self.lastOrderNumber = max(self.lastOrderNumber, order.OrderNumber)
+        self.dirty.discard(order.OrderNumber)
+
+    def remove(self, orderNumber):
+        order = self.orders.pop(orderNumber, None)
+        if order is None:
+            return
+        key = self._bucket(order)
+        bucket = self.monthly[key]
+        bucket[0] -= 1
+        if bucket[0] == 0:
+            del self.monthly[key]
+        else:
+            bucket[1] -= np.array([float(getattr(order, field) or 0) for field in ORDER_TOTAL_FIELDS])
+
+    def mark_dirty(self, orderNumber):
+        self.dirty.add(int(orderNumber))
+
+    def watch(self, eventBus):
+        #Marks orders touched through Database write methods for the next refresh
+        def onEvent(event):
+            self.mark_dirty(event.orderNumber)
+            if isinstance(event, OrderCreated):
+                self.mark_dirty(event.sourceOrderNumber)
+        for eventType in (OrderShipped, OrderCreated, ItemDeleted):
+            eventBus.subscribe(onEvent, eventType)
+        return(onEvent)
+
+    def order_totals(self, startDate = None):
+        if startDate is not None and not isinstance(startDate, datetime):
+            startDate = datetime.combine(startDate, datetime.min.time())
+        return([order for order in self.orders.values()
+                if startDate is None or order.OrderDate >= startDate])
+
+    def monthly_data(self, startDate = None):
+        #One row per customer per month: (Company, PriceLevel, IncomeStream, year, month, totals)
+        start = (startDate.year, startDate.month) if startDate is not None else None
+        rows = []
+        for (customer, month), (count, values) in sorted(self.monthly.items(), key=lambda item: item[0][1]):
+            if start is None or month >= start:
+                rows.append(customer + month + (dict(zip(CUSTOMER_DATA_FIELDS, values.tolist())),))
+        return(rows)
+
+    def customer_data(self, startDate = None):
+        #Rollup equivalent of Database.getCustomerData
+        start = (startDate.year, startDate.month) if startDate is not None else None
+        totals = {}
+        for (customer, month), (count, values) in self.monthly.items():
+            if start is not None and month < start:
+                continue
+            company, priceLevel, incomeStream = customer
+            key = (company, self.priceLevels.get(priceLevel), incomeStream)
+            if key in totals:
+                totals[key] = totals[key] + values
+            else:
+                totals[key] = values.copy()
+        return([CustomerTotal(*(key + tuple(values.tolist())))
+                for key, values in totals.items()
+                if values[CUSTOMER_DATA_FIELDS.index('QuantityShipped')] > 0])
+
+    def save(self, filePath):
+        orders = []
+        for order in self.orders.values():
+            order = list(order)
+            order[-1] = order[-1].isoformat()
+            orders.append([float(value) if isinstance(value, Decimal) else value for value in order])
+        data = {'orders': orders,
+                'priceLevels': list(self.priceLevels.items()),
+                'dirty': sorted(self.dirty),
+                'lastReconciled': self.lastReconciled.isoformat() if self.lastReconciled else None}
+        with open(filePath, 'w') as rollupFile:
+            json.dump(data, rollupFile)
+        return(filePath)
+
+    @classmethod
+    def load(cls, filePath):
+        rollup = cls()
+        with open(filePath) as rollupFile:
+            data = json.load(rollupFile)
+        for order in data['orders']:
+            order[-1] = datetime.fromisoformat(order[-1])
+            rollup.put(order)
+        rollup.priceLevels = dict((level, name) for level, name in data['priceLevels'])
+        rollup.dirty = set(data['dirty'])
+        if data.get('lastReconciled'):
+            rollup.lastReconciled = datetime.fromisoformat(data['lastReconciled'])
+        return(rollup)
+
+
+
+class SQLServerDialect:
+    #Queries in this module are written for SQL Server. A dialect rewrites the
+    #few backend specific pieces of a statement before it is run
+    name = 'sqlserver'
+    now = 'GETDATE()'
+    defaultValue = 'DEFAULT'
+    bracketIdentifiers = False
+    fastExecuteMany = True
+    cacheSize = 1024
+
+    def __init__(self):
+        self.cache = {}
+
+    def render(self, SQL):
+        rendered = self.cache.get(SQL)
+        if rendered is None:
+            rendered = self.translate(SQL)
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            self.cache[SQL] = rendered
+        return(rendered)
+
+    def translate(self, SQL):
+        SQL = SQL.replace('GETDATE()', self.now)
+        if self.bracketIdentifiers:
+            SQL = re.sub(r'"([^"\r\n]+)"', r'[\1]', SQL)
+        return(SQL)
+
+    def like_prefix(self, column, prefix):
+        pattern = prefix.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]')
+        return(column + ' LIKE ?', pattern + '%')
+
+
+class AccessDialect(SQLServerDialect):
+    #Jet reads "Name" as a string literal and has no DEFAULT keyword,
+    #a NULL AutoNumber is filled in instead
+    name = 'access'
+    now = 'Now()'
+    defaultValue = 'NULL'
+    bracketIdentifiers = True
+    fastExecuteMany = False
+
+
+class SQLiteDialect(SQLServerDialect):
+    #Local copy of the schema for testing and offline analytics. A NULL
+    #INTEGER PRIMARY KEY is assigned the next rowid
+    name = 'sqlite'
+    now = "datetime('now', 'localtime')"
+    defaultValue = 'NULL'
+    fastExecuteMany = False
+
+    def like_prefix(self, column, prefix):
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return(column + " LIKE ? ESCAPE '\\'", pattern + '%')
+
+
+DIALECTS = {'sqlserver': SQLServerDialect,
+            'access': AccessDialect,
+            'sqlite': SQLiteDialect}
+
+def dialectFor(dsn, dialect = None):
+    #dialect may be a name from DIALECTS, a dialect instance or None to
+    #guess from the ODBC driver named in the DSN
+    if dialect is None:
+        lowered = dsn.lower()
+        if 'sqlite' in lowered:
+            dialect = 'sqlite'
+        elif 'access' in lowered or '.mdb' in lowered or '.accdb' in lowered:
+            dialect = 'access'
+        else:
+            dialect = 'sqlserver'
+    if isinstance(dialect, str):
+        return(DIALECTS[dialect]())
+    return(dialect)
+
+
+class DialectCursor:
+    #pyodbc cursor that renders every statement for its dialect
+    def __init__(self, cursor, dialect):
+        object.__setattr__(self, 'cursor', cursor)
+        object.__setattr__(self, 'dialect', dialect)
+
+    def execute(self, SQL, *params):
+        return(self.cursor.execute(self.dialect.render(SQL), *params))
+
+    def executemany(self, SQL, paramList):
+        return(self.cursor.executemany(self.dialect.render(SQL), paramList))
+
+    def __iter__(self):
+        return(iter(self.cursor))
+
+    def __getattr__(self, name):
+        return(getattr(self.cursor, name))
+
+    def __setattr__(self, name, value):
+        setattr(self.cursor, name, value)
+
+
+class ConnectionPool:
+    #Thread-safe pool of autocommit connections to one DSN, opened on demand
+    def __init__(self, dsn, size = 8):
+        self.dsn = dsn
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return(self.idle.get_nowait())
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.opened < self.size
+            if create:
+                self.opened += 1
+        if not create:
+            return(self.idle.get())
+        try:
+            return(pyodbc.connect(self.dsn, autocommit = True))
+        except:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+
+def partitionBounds(low, high, partitions):
+    #Splits [low, high] into contiguous half-open ranges. The first range has
+    #no lower bound and the last no upper bound, so no row is ever missed
+    if low is None or high is None or partitions <= 1:
+        return([(None, None)])
+    if isinstance(low, int):
+        step = max(1, -(-(high - low + 1) // partitions))
+    else:
+        step = (high - low) / partitions
+    bounds = []
+    start = None
+    for i in range(1, partitions):
+        stop = low + step*i
+        if stop > high:
+            break
+        bounds.append((start, stop))
+        start = stop
+    bounds.append((start, None))
+    return(bounds)
+
+
+def rangeClause(column, start, stop):
+    #The open-ended first range also takes NULLs, which sort first
+    clause = ""
+    params = ()
+    if start is not None:
+        clause += " AND " + column + " >= ?"
+        params += (start,)
+    if stop is not None:
+        if start is None:
+            clause += " AND (" + column + " < ? OR " + column + " IS NULL)"
+        else:
+            clause += " AND " + column + " < ?"
+        params += (stop,)
+    return(clause, params)
+
+
+def splitBounds(keys, counts, partitions):
+    #Bounds from keys already in server sort order, cut where the running
+    #row count crosses each 1/partitions share. Comparing keys in Python
+    #would not follow the server collation, so only their positions are used
+    if partitions <= 1 or len(keys) < 2:
+        return([(None, None)])
+    total = float(sum(counts))
+    splits = []
+    running = 0
+    share = 1
+    for key, count in zip(keys, counts):
+        if running >= total*share/partitions and running > 0:
+            splits.append(key)
+            while running >= total*share/partitions:
+                share += 1
+        running += count
+    bounds = []
+    start = None
+    for stop in splits:
+        bounds.append((start, stop))
+        start = stop
+    bounds.append((start, None))
+    return(bounds)
+
+
+CUSTOMER_ORDER_ITEMS_SQL = """
+SELECT Customers.PriceLevel, Orders.OrderDate, [Order Details].SKU, [Order Details].PricePerUnit, Customers.CustomerID, [Order Details].OrderNumber
+FROM (Orders INNER JOIN Customers ON Orders.CustomerID = Customers.CustomerID) INNER JOIN [Order Details] ON Orders.OrderNumber = [Order Details].OrderNumber
+WHERE (Customers.PriceLevel>0 AND Orders.OrderDate<=? AND Orders.OrderDate>? AND (([Order Details].Adjustment)=0)){0};
+"""
+CUSTOMER_ORDER_ITEM_COLUMNS = ['PriceLevel', 'OrderDate', 'SKU', 'PricePerUnit', 'CustomerID', 'OrderNumber']
+
+def rowsToFrame(partitions, columns):
+    #Combines partition row lists into one DataFrame
+    frames = [pandas.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+              for rows in partitions if len(rows)]
+    if not frames:
+        return(pandas.DataFrame(columns=columns))
+    return(pandas.concat(frames, ignore_index=True))
+
+
+STATION_DATE_COLUMNS = {"Engraving":"Date1",
+                        "Welding":"Date2",
+                        "PC/Paint":"Date3",
+                        "Paint Fill":"Date4",
+                        "Packaging":"Date5"}
+TIMESTAMP_FORMATS = ['%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M', '%m/%d/%y %H:%M:%S', '%m/%d/%y %H:%M']
+ScanRecord = namedtuple('ScanRecord', ['line', 'orderNumber', 'itemNumber', 'status',
+                                       'initials', 'timestamp', 'note'])
+
+def parseTimestamp(text, timeFormat = None):
+    text = text.strip()
+    if timeFormat is not None:
+        return(datetime.strptime(text, timeFormat))
+    try:
+        return(datetime.fromisoformat(text))
+    except ValueError:
+        pass
+    for timeFormat in TIMESTAMP_FORMATS:
+        try:
+            return(datetime.strptime(text, timeFormat))
+        except ValueError:
+            pass
+    raise ValueError("Unreadable timestamp: " + text)
+
+
+def parseScanLine(line, fields, timeFormat = None):
+    #orderstring, status, initials, timestamp[, note]
+    if len(fields) < 4:
+        raise ValueError("Expected orderstring, status, initials, timestamp")
+    orderstring = fields[0].strip()
+    if len(orderstring) < 3 or not orderstring.isdigit():
+        raise ValueError("Bad orderstring: " + orderstring)
+    status = fields[1].strip()
+    if status == "":
+        raise ValueError("Missing status")
+    note = fields[4].strip() if len(fields) > 4 else ''
+    return(ScanRecord(line, int(orderstring[:-2]), int(orderstring[-2:]), status,
+                      fields[2].strip(), parseTimestamp(fields[3], timeFormat), note))
+
+
+def readScanFile(filePath, startLine = 0):
+    #Streams (line, fields) from a scan log, skipping a header row and
+    #everything up to startLine
+    with open(filePath, newline = '') as scanFile:
+        for line, fields in enumerate(csv.reader(scanFile), start = 1):
+            if not fields or line <= startLine:
+                continue
+            if line == 1 and fields[0].strip().lower() == 'orderstring':
+                continue
+            yield(line, fields)
+
+
+def readCheckpoint(checkpointPath, filePath):
+    if not path.exists(checkpointPath):
+        return(None)
+    with open(checkpointPath) as checkpointFile:
+        checkpoint = json.load(checkpointFile)
+    if checkpoint.get('file') != path.abspath(filePath):
+        return(None)
+    return(checkpoint)
+
+
+def writeCheckpoint(checkpointPath, checkpoint):
+    #Written to a temporary file and renamed so a crash never leaves half a checkpoint
+    with open(checkpointPath + '.tmp', 'w') as checkpointFile:
+        json.dump(checkpoint, checkpointFile)
+    replace(checkpointPath + '.tmp', checkpointPath)
+
+
+def ingestScanFile(db, filePath, chunkSize = 500, checkpointPath = None, restart = False,
+                   dryRun = False, rejectsPath = None, timeFormat = None):
+    #Replays an offline scan log through Database.apply_status_batch, one
+    #transaction per chunk. The checkpoint is written just after each commit,
+    #so a crash between the two replays that chunk: status updates are
+    #idempotent but its Notes rows are inserted again (at least once)
+    if checkpointPath is None:
+        checkpointPath = filePath + '.checkpoint'
+    checkpoint = None if restart else readCheckpoint(checkpointPath, filePath)
+    if checkpoint is None:
+        checkpoint = {'file': path.abspath(filePath), 'line': 0, 'applied': 0, 'rejected': 0}
+    elif not dryRun:
+        print("Resuming after line " + str(checkpoint['line']))
+
+    rejectsFile = None
+    if rejectsPath is not None:
+        rejectsFile = open(rejectsPath, 'a', newline = '')
+        rejectsWriter = csv.writer(rejectsFile)
+
+    verb = 'validated' if dryRun else 'applied'
+    totals = {'valid': 0, 'rejected': 0}
+
+    def flush(chunk, lastLine):
+        chunkStart = time.time()
+        #Rejects keep the raw fields, in line order, so the rejects file can
+        #be corrected and replayed as a scan log
+        scans = []
+        rejects = []
+        for line, fields in chunk:
+            try:
+                scans.append((parseScanLine(line, fields, timeFormat), fields))
+            except ValueError as err:
+                rejects.append([line, str(err)] + list(fields))
+        found = db.existing_items((scan.orderNumber, scan.itemNumber) for scan, fields in scans)
+        valid = []
+        for scan, fields in scans:
+            if (scan.orderNumber, scan.itemNumber) in found:
+                valid.append(scan)
+            else:
+                rejects.append([scan.line, "Unknown order item"] + list(fields))
+        rejects.sort(key = lambda reject: reject[0])
+        if not dryRun:
+            try:
+                db.apply_status_batch(valid)
+                db.commit()
+            except:
+                db.rollback()
+                raise
+            checkpoint['line'] = lastLine
+            checkpoint['applied'] += len(valid)
+            checkpoint['rejected'] += len(rejects)
+            writeCheckpoint(checkpointPath, checkpoint)
+        #Only once the chunk is committed, so rerunning a failed chunk
+        #never appends its rejects twice
+        if rejectsFile is not None:
+            rejectsWriter.writerows(rejects)
+            rejectsFile.flush()
+        totals['valid'] += len(valid)
+        totals['rejected'] += len(rejects)
+        elapsed = max(time.time() - chunkStart, 1e-9)
+        print("Lines {0}-{1}: {2} {3}, {4} rejected, {5:.0f} lines/s".format(
+            chunk[0][0], lastLine, len(valid), verb, len(rejects), len(chunk)/elapsed))
+
+    startTime = time.time()
+    chunk = []
+    try:
+        for line, fields in readScanFile(filePath, checkpoint['line']):
+            chunk.append((line, fields))
+            if len(chunk) >= chunkSize:
+                flush(chunk, line)
+                chunk = []
+        if chunk:
+            flush(chunk, chunk[-1][0])
+    finally:
+        if rejectsFile is not None:
+            rejectsFile.close()
+
+    elapsed = max(time.time() - startTime, 1e-9)
+    print("{0} updates {1}, {2} rejected in total, {3:.1f}s, {4:.0f} updates/s".format(
+        totals['valid'], verb, totals['rejected'], elapsed, totals['valid']/elapsed))
+    return(checkpoint)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Utilities for the MGP Stone Edge database')
+    commands = parser.add_subparsers(dest = 'command')
+
+    ingest = commands.add_parser('ingest', help = 'Replay an offline scan log (orderstring, status, initials, timestamp[, note])')
+    ingest.add_argument('scanfile')
+    ingest.add_argument('--dsn', default = SQL_DB)
+    ingest.add_argument('--user', default = 'BOT')
+    ingest.add_argument('--chunk-size', type = int, default = 500)
+    ingest.add_argument('--checkpoint', default = None, help = 'Defaults to <scanfile>.checkpoint')
+    ingest.add_argument('--restart', action = 'store_true', help = 'Ignore an existing checkpoint')
+    ingest.add_argument('--dry-run', action = 'store_true', help = 'Validate only, write nothing')
+    ingest.add_argument('--rejects', default = None, help = 'Append rejected lines to this CSV')
+    ingest.add_argument('--time-format', default = None, help = 'strptime format of the timestamp column')
+
+    commands.add_parser('smoke', help = 'Connection smoke test')
+
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        with Database(args.user, writeDSN = args.dsn) as db:
+            ingestScanFile(db, args.scanfile,
+                           chunkSize = args.chunk_size,
+                           checkpointPath = args.checkpoint,
+                           restart = args.restart,
+                           dryRun = args.dry_run,
+                           rejectsPath = args.rejects,
+                           timeFormat = args.time_format)
+    elif args.command == 'smoke':
+        with Database('BOT') as db:
+            print(db.order_is_cancelled("1001"))
+            print('"{0}"'.format(db.get_item_status("1001","02")))
+            input("")
+            print('Databaseutils')
+    else:
+        parser.print_help()
+
+
 class Database:
-    def __init__(self, user = ''):
-        self.conn = pyodbc.connect(SQL_DB)
-        self.cursor = self.conn.cursor()
+    def __init__(self, user = '', writeDSN = SQL_DB, readDSN = None, readPrimary = False,
+                 eventBus = None, dialect = None):
+        #Every statement is rendered for the backend behind writeDSN
+        self.dialect = dialectFor(writeDSN, dialect)
+
+        #Writes, and any read inside an open write transaction, use the primary
+        self.conn = pyodbc.connect(writeDSN)
+        self.cursor = DialectCursor(self.conn.cursor(), self.dialect)
+
+        #Lookup and analytic reads go to the replica when one is given
+        if readDSN is None or readDSN == writeDSN:
+            self.readConn = self.conn
+            self.readCursor = self.cursor
+        else:
+            self.readConn = pyodbc.connect(readDSN, autocommit = True)
+            self.readCursor = DialectCursor(self.readConn.cursor(), self.dialect)
+
+        self.writeDSN = writeDSN
+        self.readDSN = writeDSN if readDSN is None else readDSN
+        self.scanPool = None
+
         self.user = user
+        self.readPrimary = readPrimary
+        self.inTransaction = False
+        self.skuCatalog = None
+        if eventBus is None:
+            eventBus = EventBus()
+        self.eventBus = eventBus
+        self.pendingEvents = []
 
     def __enter__(self):
         return self
 
-    def close(self):
+    def _read_cursor(self):
+        if self.readPrimary or self.inTransaction:
+            return(self.cursor)
+        return(self.readCursor)
+
+    def _write(self, SQL, *params):
+        self.inTransaction = True
+        self.cursor.execute(SQL, *params)
+
+    def _write_many(self, SQL, paramList):
+        self.inTransaction = True
+        self.cursor.fast_executemany = self.dialect.fastExecuteMany
+        self.cursor.executemany(SQL, paramList)
+
+    def _emit(self, event):
+        #Held until commit so subscribers never see uncommitted changes
+        self.pendingEvents.append(event)
+
+    @contextmanager
+    def primary_reads(self):
+        #Read-your-writes override for reads that must see the last commit
+        previous = self.readPrimary
+        self.readPrimary = True
+        try:
+            yield self
+        finally:
+            self.readPrimary = previous
+
+    def commit(self):
         self.conn.commit()
+        self.inTransaction = False
+        events, self.pendingEvents = self.pendingEvents, []
+        for event in events:
+            self.eventBus.publish(event)
+
+    def rollback(self):
+        self.conn.rollback()
+        self.inTransaction = False
+        self.pendingEvents = []
+
+    def close(self):
+        self.commit()
         self.cursor.close()
         self.conn.close()
+        if self.readConn is not self.conn:
+            self.readCursor.close()
+            self.readConn.close()
+        if self.scanPool is not None:
+            self.scanPool.close()
         print('Connection closed')
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
     def get_sku(self,orderstring):
+        cursor = self._read_cursor()
         ordernum = int(orderstring[:-2])
         itemnum = int(orderstring[-2:])
         SQL = """
@@ -78,18 +1338,19 @@ FROM "Order Details"
 WHERE OrderNumber=? AND ItemNumber=?;
 """
         values = (ordernum, itemnum)
-        self.cursor.execute(SQL,values)
-        result = self.cursor.fetchone()[2]
+        cursor.execute(SQL,values)
+        result = cursor.fetchone()[2]
         return(result)
 
     def get_customer_name(self, ordernum):
+        cursor = self._read_cursor()
         SQL = """
 SELECT OrderNumber, Company, ShipName
 FROM "Orders"
 WHERE OrderNumber = ?
 """
-        self.cursor.execute(SQL, ordernum)
-        result = self.cursor.fetchone()
+        cursor.execute(SQL, ordernum)
+        result = cursor.fetchone()
         if result is None:
             return("")
         if (result[1] is None) or (result[1] == ""):
@@ -115,14 +1376,12 @@ WHERE OrderNumber = ?
             itemnum = '00'
 
         sql = """
-SET NOCOUNT ON;
-DECLARE @DateTimeVal DATETIME;
-SET @DateTimeVal = GETDATE();
 INSERT INTO Notes (Type, NumericKey, ItemNumber, EntryDate, EntryTime, Notes, Completed, EnteredBy, ParentType, ParentKey, Event)
-VALUES ('O', ?, ?, @DateTimeVal , @DateTimeVal, ?, 0, ?, 'O', ?, ?);
+VALUES ('O', ?, ?, GETDATE(), GETDATE(), ?, 0, ?, 'O', ?, ?);
 """
         params = (ordernum, itemnum, note, initials,  str(ordernum), statusstring)
-        self.cursor.execute(sql, params)
+        self._write(sql, params)
+        self._emit(NoteInserted(int(ordernum), int(itemnum), statusstring, note))
 
     def update_status(self,
                       statusstring,
@@ -157,14 +1416,9 @@ SET Date1=NULL, Date2=NULL, Date3=NULL, Date4=NULL, Date5=NULL
 WHERE OrderNumber=? AND ItemNumber=?;
 """
             params = (ordernum, itemnum)
-            self.cursor.execute(SQL,params)
+            self._write(SQL,params)
 
         today = datetime.today()
-        ColDict = {"Engraving":", Date1=?",
-                   "Welding":", Date2=?",
-                   "PC/Paint":", Date3=?",
-                   "Paint Fill":", Date4=?",
-                   "Packaging": ", Date5=?"}
         SQL = """
 UPDATE "Order Details"
 SET Status=?, StatusChanged=-1{0}
@@ -172,20 +1426,85 @@ WHERE OrderNumber=? AND ItemNumber=?;
 """
 
         try:
-            SQL = SQL.format(ColDict[statusstring])
+            SQL = SQL.format(", "+STATION_DATE_COLUMNS[statusstring]+"=?")
             params = (statusstring, today, ordernum, itemnum)
         except KeyError:
             SQL = SQL.format("")
             params = (statusstring, ordernum, itemnum)
 
-        self.cursor.execute(SQL,params)
+        self._write(SQL,params)
+        self._emit(StatusChanged(int(ordernum), int(itemnum), statusstring, initials))
         note = 'Item '+str(itemnum)+' in '+statusstring+' '+note
         self.insert_note(note,
                          str(ordernum)+str(format(itemnum, '02')),
                          initials,
                          statusstring)
         if commit:
-            self.conn.commit()
+            self.commit()
+
+    def existing_items(self, pairs, batchSize = 500):
+        #Returns the subset of (OrderNumber, ItemNumber) pairs present in Order Details
+        pairs = set(pairs)
+        orderNumbers = sorted(set(orderNumber for orderNumber, itemNumber in pairs))
+        SQL = """
+SELECT OrderNumber, ItemNumber
+FROM "Order Details"
+WHERE OrderNumber IN ({0})
+"""
+        found = set()
+        for i in range(0, len(orderNumbers), batchSize):
+            batch = orderNumbers[i:i+batchSize]
+            self.cursor.execute(SQL.format(', '.join('?'*len(batch))), batch)
+            for row in self.cursor.fetchall():
+                key = (int(row.OrderNumber), int(row.ItemNumber))
+                if key in pairs:
+                    found.add(key)
+        return(found)
+
+    def apply_status_batch(self, scans):
+        #Batched update_status_num for ScanRecords, stamped with each scan's
+        #own time. The n-th scan of an item in the batch goes in round n, and
+        #each round runs one executemany per status, so repeated scans of an
+        #item still apply in file order
+        noteSQL = """
+INSERT INTO Notes (Type, NumericKey, ItemNumber, EntryDate, EntryTime, Notes, Completed, EnteredBy, ParentType, ParentKey, Event)
+VALUES ('O', ?, ?, ?, ?, ?, 0, ?, 'O', ?, ?);
+"""
+        seen = {}
+        rounds = []
+        for scan in scans:
+            key = (scan.orderNumber, scan.itemNumber)
+            n = seen.get(key, 0)
+            seen[key] = n+1
+            if n == len(rounds):
+                rounds.append({})
+            rounds[n].setdefault(scan.status, []).append(scan)
+        runs = [run for statusRuns in rounds for run in statusRuns.values()]
+
+        for run in runs:
+            status = run[0].status
+            SQL = """
+UPDATE "Order Details"
+SET Status=?, StatusChanged=-1{0}
+WHERE OrderNumber=? AND ItemNumber=?;
+"""
+            if status in STATION_DATE_COLUMNS:
+                SQL = SQL.format(", "+STATION_DATE_COLUMNS[status]+"=?")
+                params = [(status, scan.timestamp, scan.orderNumber, scan.itemNumber) for scan in run]
+            else:
+                SQL = SQL.format("")
+                params = [(status, scan.orderNumber, scan.itemNumber) for scan in run]
+            self._write_many(SQL, params)
+
+            notes = []
+            for scan in run:
+                note = 'Item '+str(scan.itemNumber)+' in '+status+' '+scan.note
+                notes.append((str(scan.orderNumber), format(scan.itemNumber, '02'),
+                              scan.timestamp, scan.timestamp, note, scan.initials,
+                              str(scan.orderNumber), status))
+                self._emit(StatusChanged(scan.orderNumber, scan.itemNumber, status, scan.initials))
+                self._emit(NoteInserted(scan.orderNumber, scan.itemNumber, status, note))
+            self._write_many(noteSQL, notes)
 
     def update_order_status(self,
                             statusstring,
@@ -196,8 +1515,10 @@ WHERE OrderNumber=? AND ItemNumber=?;
                             note = ''):
         if type(ordernum) is str:
             ordernum = int(ordernum[:-2])
-        #Retrieve list of items, SKU, and identifiers
-        itemList = self.get_order_items(ordernum)
+        #Retrieve list of items, SKU, and identifiers. Read from the primary,
+        #the items about to be updated must not come from a lagging replica
+        with self.primary_reads():
+            itemList = self.get_order_items(ordernum)
 
         #Tick through items in the order
         skuList = []
@@ -214,57 +1535,73 @@ WHERE OrderNumber=? AND ItemNumber=?;
                 skuList.append(row.SKU)
 
         if commit:
-            self.conn.commit()
+            self.commit()
         return(skuList, itemList)
 
     def get_inventory_data(self):
+        cursor = self._read_cursor()
         SQL = """
 SELECT LocalSKU, ItemName, QOH, Price, Location, Discontinued, Text5, Category, Image, Price2, Price3, Price4, Price5, Price6, Price8, Price9, Price10, RetailPrice, Description, Length, Width, Height, UPC, MAP
 FROM Inventory
 WHERE Discontinued=0 AND QOH>=0 AND NOT UPC='None' AND NOT UPC='' AND Category='FGPN'
 ORDER BY QOH DESC
 """
-        self.cursor.execute(SQL)
-        inventoryData = self.cursor.fetchall()
+        cursor.execute(SQL)
+        inventoryData = cursor.fetchall()
         return(inventoryData)
 
     def get_inventory_dict(self):
+        cursor = self._read_cursor()
         SQL = """
 SELECT LocalSKU, ItemName, QOH, Price, Location, Discontinued, Text5, Category, Image, Price2, Price3, Price4, Price5, Price6, Price7, Price8, Price9, Price10, RetailPrice, Description, Length, Width, Height, UPC, MAP
 FROM Inventory
 WHERE Discontinued=0 AND QOH>=0 AND NOT UPC='None' AND NOT UPC='' AND Category='FGPN'
 ORDER BY QOH DESC
 """
-        self.cursor.execute(SQL)
-        columns = [column[0] for column in self.cursor.description]
+        cursor.execute(SQL)
+        columns = [column[0] for column in cursor.description]
         invDict = {}
-        for row in self.cursor.fetchall():
+        for row in cursor.fetchall():
             invDict[row.LocalSKU] = (dict(zip(columns, row)))
         return(invDict)
 
+    def get_inventory_snapshot(self):
+        #Compact, shareable alternative to get_inventory_dict
+        cursor = self._read_cursor()
+        SQL = """
+SELECT LocalSKU, ItemName, QOH, Price, Location, Discontinued, Text5, Category, Image, Price2, Price3, Price4, Price5, Price6, Price7, Price8, Price9, Price10, RetailPrice, Description, Length, Width, Height, UPC, MAP
+FROM Inventory
+WHERE Discontinued=0 AND QOH>=0 AND NOT UPC='None' AND NOT UPC='' AND Category='FGPN'
+ORDER BY QOH DESC
+"""
+        cursor.execute(SQL)
+        return(InventorySnapshot.from_cursor(cursor))
+
     def get_inventory_row(self, sku):
+        cursor = self._read_cursor()
         SQL = """
 SELECT *
 FROM Inventory
 WHERE LocalSKU = ?
 """
         values = sku
-        self.cursor.execute(SQL,sku)
-        inventoryData = self.cursor.fetchone()
+        cursor.execute(SQL,sku)
+        inventoryData = cursor.fetchone()
         return(inventoryData)
 
     def get_row(self, sku):
+        cursor = self._read_cursor()
         SQL = """
 SELECT *
 FROM Inventory
 WHERE LocalSKU = ?
 """
         values = sku
-        self.cursor.execute(SQL,sku)
-        columns = [column[0] for column in self.cursor.description]
+        cursor.execute(SQL,sku)
+        columns = [column[0] for column in cursor.description]
 
         try:
-            results = (dict(zip(columns,self.cursor.fetchone())))
+            results = (dict(zip(columns,cursor.fetchone())))
         except TypeError:
             print("Sku not found: " + sku)
             results = None
@@ -272,39 +1609,62 @@ WHERE LocalSKU = ?
         return(results)
 
     def get_image(self, sku):
+        cursor = self._read_cursor()
         SQL = """
 SELECT LocalSKU, Image
 FROM Inventory
 WHERE LocalSKU = ?
 """
         values = sku
-        self.cursor.execute(SQL,sku)
-        imageData = self.cursor.fetchone()
+        cursor.execute(SQL,sku)
+        imageData = cursor.fetchone()
         return(imageData.Image)
 
-    def get_sku_lists(self):
-        ##Returns list of active SKUs, and a list of discontinued SKUs
+    def get_sku_catalog(self, refresh = False):
+        #Loaded once per connection, then only stale SKUs are re-read
+        if self.skuCatalog is None or refresh:
+            cursor = self._read_cursor()
+            SQL = """
+SELECT LocalSKU, Discontinued, Category
+FROM Inventory
+"""
+            cursor.execute(SQL)
+            self.skuCatalog = SkuCatalog(cursor.fetchall())
+        elif self.skuCatalog.stale:
+            #Stale SKUs were invalidated by this connection's own writes,
+            #which a lagging replica may not have yet
+            with self.primary_reads():
+                self.refresh_sku_catalog(self.skuCatalog.stale)
+        return(self.skuCatalog)
+
+    def refresh_sku_catalog(self, skuList):
+        if self.skuCatalog is None:
+            return
+        skuList = list(skuList)
+        cursor = self._read_cursor()
         SQL = """
 SELECT LocalSKU, Discontinued, Category
 FROM Inventory
+WHERE LocalSKU IN ({0})
 """
-        self.cursor.execute(SQL)
-        invList = self.cursor.fetchall()
-
-        fgpnList = []
-        custList = []
-        discontinued = []
-        for row in invList:
-            if row.Discontinued or (row.Category == "MTO"):
-                discontinued.append(row.LocalSKU)
-            elif (row.Category == 'FGPN'):
-                fgpnList.append(row.LocalSKU)
-            elif (row.Category == 'Base'):
-                custList.append(row.LocalSKU)
+        for i in range(0, len(skuList), 500):
+            batch = skuList[i:i+500]
+            cursor.execute(SQL.format(', '.join('?'*len(batch))), batch)
+            found = set()
+            for row in cursor.fetchall():
+                self.skuCatalog.update(row.LocalSKU, row.Discontinued, row.Category)
+                found.add(row.LocalSKU)
+            for sku in batch:
+                if sku not in found:
+                    self.skuCatalog.remove(sku)
+                    self.skuCatalog.stale.discard(sku)
 
-        return(fgpnList, custList, discontinued)
+    def get_sku_lists(self):
+        ##Returns list of active SKUs, and a list of discontinued SKUs
+        return(self.get_sku_catalog().lists())
 
     def get_order_items(self, orderNumber):
+        cursor = self._read_cursor()
         SQL = """
 SELECT OrderNumber, ItemNumber, Adjustment, SKU, QuantityNeeded,
 QuantityShipped, QuantityOrdered, QuantityPacked, Status
@@ -312,8 +1672,8 @@ FROM "Order Details"
 WHERE OrderNumber = ?
 """
         values = orderNumber
-        self.cursor.execute(SQL, values)
-        orderData = self.cursor.fetchall()
+        cursor.execute(SQL, values)
+        orderData = cursor.fetchall()
         return(orderData)
 
     def fill_backorder(self, orderNumber):
@@ -324,24 +1684,27 @@ Backordered = 0, DateShipped = GETDATE()
 WHERE OrderNumber=? AND Adjustment = 0
 """
         values = orderNumber
-        self.cursor.execute(SQL, values)
+        self._write(SQL, values)
         return()
 
     def is_approved(self, orderNumber):
+        cursor = self._read_cursor()
         SQL = """
 SELECT OrderNumber, Approved
 FROM Orders
 WHERE OrderNumber = ?
 """
-        self.cursor.execute(SQL, orderNumber)
-        result = self.cursor.fetchone()
+        cursor.execute(SQL, orderNumber)
+        result = cursor.fetchone()
         return(result.Approved)
 
     def mark_shipped(self, orderNumber):
         initials = self.user
 
-        #Retrieve list of items, SKU, and identifiers
-        itemList = self.get_order_items(orderNumber)
+        #Retrieve list of items, SKU, and identifiers. Read from the primary,
+        #the adjustment row to delete must not come from a lagging replica
+        with self.primary_reads():
+            itemList = self.get_order_items(orderNumber)
 
         #Check for shipping adjustment.
         hasAdjustment = False
@@ -365,7 +1728,8 @@ WHERE OrderNumber = ?
                                            orderNumber,
                                            initials,
                                            commit = False)
-        self.conn.commit()
+        self._emit(OrderShipped(orderNumber, skuList[0]))
+        self.commit()
         return(skuList, orderNumber)
 
     def delete_item(self, orderNumber, itemNumber):
@@ -374,18 +1738,20 @@ DELETE FROM "Order Details"
 WHERE OrderNumber = ? AND ItemNumber = ?
 """
         values = orderNumber, itemNumber
-        self.cursor.execute(SQL, values)
+        self._write(SQL, values)
+        self._emit(ItemDeleted(orderNumber, itemNumber))
         return
 
     def has_shipped_items(self, orderNumber):
+        cursor = self._read_cursor()
         SQL = """
 SELECT OrderNumber, QuantityShipped
 FROM "Order Details"
 WHERE OrderNumber=? AND QuantityShipped > 0
 """
         values = orderNumber
-        self.cursor.execute(SQL, values)
-        data = self.cursor.fetchone()
+        cursor.execute(SQL, values)
+        data = cursor.fetchone()
         if data is None:
             return(False)
         else:
@@ -407,7 +1773,7 @@ SET QuantityNeeded = 0,
 Backordered = 0, DateShipped = GETDATE()
 WHERE OrderNumber=? AND Adjustment = 0
 """
-        self.cursor.execute(SQL, values)
+        self._write(SQL, values)
 
         backorderedItems = []
         for item in orderedItems:
@@ -433,9 +1799,8 @@ WHERE OrderNumber = ?
         row = self.cursor.fetchone()
 
         SQL = """
-SELECT TOP(1) [OrderNumber]
+SELECT MAX(OrderNumber) AS OrderNumber
 FROM "Orders"
-ORDER BY (OrderNumber) DESC
 """
         self.cursor.execute(SQL)
         bottomOrderNumber = self.cursor.fetchone()
@@ -469,15 +1834,15 @@ ORDER BY (OrderNumber) DESC
     def insert_row(self, item, table = '"Order Details"'):
         SQL = """
 INSERT INTO {0}
-VALUES """.format(table)
+VALUES (""".format(table)
 
         values = []
         for i in range(0,len(item)-1):
             SQL += "?, "
             values.append(item[i])
 
-        SQL += "DEFAULT)"
-        self.cursor.execute(SQL,values)
+        SQL += self.dialect.defaultValue + ")"
+        self._write(SQL,values)
         return
 
     def insert_rows(self, itemList):
@@ -509,7 +1874,8 @@ ExpectedNet = ?, ActualNet = ?
 WHERE OrderNumber = ?
 """
         values = (finalTotal, finalWeight, expectedNet, actualNet, newOrderNumber)
-        self.cursor.execute(SQL, values)
+        self._write(SQL, values)
+        self._emit(OrderCreated(newOrderNumber, orderNumber, len(itemList)))
         return(newOrderNumber)
 
     def update_inventory(self, sku, valueDict):
@@ -524,11 +1890,16 @@ WHERE OrderNumber = ?
         params.append(sku)
         SQL2 = SQL2[:-2]
         SQL = SQL1+SQL2+SQL3+';'
-        self.cursor.execute(SQL,params)
+        self._write(SQL,params)
+        if self.skuCatalog is not None:
+            self.skuCatalog.invalidate(sku)
+        self._emit(InventoryUpdated(sku, dict(valueDict)))
 
-    def get_status_report(self, statusList = None, filepath = "", filename = "StatusReport.xlsx"):
+    def build_status_report(self, statusList = None):
+        cursor = self._read_cursor()
         #Create Status Report DataFrame
-        report = pandas.DataFrame()
+        reportRows = []
+        reportIndex = []
         if statusList is not None:
             SQL = """
 SELECT SKU, Status, OrderNumber, ItemNumber, ExpectedShipDate, DetailDate, QuantityNeeded, Date1, Date2, Date3, Date4, Date5
@@ -554,19 +1925,17 @@ WHERE NumericKey = ? AND ItemNumber = ?
         NumLateSets = 0
         for searchItem in statusList:
             param = searchItem
-            self.cursor.execute(SQL.format(searchItem))
-            data = self.cursor.fetchall()
-            dataRow = pandas.Series()
+            cursor.execute(SQL.format(searchItem))
+            data = cursor.fetchall()
 
-            i=0
             for row in data:
 
                 ##OrderList is used for the Summary
                 OrderList.append(row.OrderNumber)
 
                 params = (row.OrderNumber, row.ItemNumber)
-                self.cursor.execute(SQL2, params)
-                rowTime = self.cursor.fetchone()
+                cursor.execute(SQL2, params)
+                rowTime = cursor.fetchone()
 
                 if rowTime is None:
                     date = ''
@@ -586,98 +1955,33 @@ WHERE NumericKey = ? AND ItemNumber = ?
                 if row.ExpectedShipDate == '' or row.ExpectedShipDate == None:
                     daysLeft = -99
 
-                dataRow = pandas.Series({'SKU':row.SKU,
-                                         'Sets': row.QuantityNeeded,
-                                         'Status':row.Status,
-                                         'Days': daysLeft,
-                                         'Engraving':row.Date1,
-                                         'Welding':row.Date2,
-                                         'PC/Paint':row.Date3,
-                                         'Paint Fill':row.Date4,
-                                         'Packaging':row.Date5,
-                                         'Customer':self.get_customer_name(row.OrderNumber)})
+                dataRow = {'SKU':row.SKU,
+                           'Sets': row.QuantityNeeded,
+                           'Status':row.Status,
+                           'Days': daysLeft,
+                           'Engraving':row.Date1,
+                           'Welding':row.Date2,
+                           'PC/Paint':row.Date3,
+                           'Paint Fill':row.Date4,
+                           'Packaging':row.Date5,
+                           'Customer':self.get_customer_name(row.OrderNumber)}
                 NumSets += row.QuantityNeeded
                 try:
-                    dataRow = dataRow.append(
-                        pandas.Series({'Ship By':row.ExpectedShipDate.date()}))
+                    dataRow['Ship By'] = row.ExpectedShipDate.date()
                 except:
                     pass
                 try:
-                    dataRow = dataRow.append(
-                        pandas.Series({'Ordered':row.DetailDate.date()}))
+                    dataRow['Ordered'] = row.DetailDate.date()
                 except:
                     pass
 
-                dataRow.name = str(row.OrderNumber)+'.'+str(row.ItemNumber).zfill(2)
-                report = report.append(dataRow)
-
+                reportRows.append(dataRow)
+                reportIndex.append(str(row.OrderNumber)+'.'+str(row.ItemNumber).zfill(2))
 
-        report = report.sort_values('Days')
-        cols = ['SKU','Sets','Days','Ordered','Ship By','Status',
-                'Engraving','Welding','PC/Paint','Paint Fill','Packaging', 'Customer']
-        report = report[cols]
-
-        #Create Inventory Report DataFrame
-        invReport = pandas.DataFrame()
-
-        #Write DataFrames to excel sheets
-        #Create file and workbook
-        writer = pandas.ExcelWriter(path.join(filepath,filename),
-                                    engine = 'xlsxwriter',
-                                    datetime_format='m/dd hh:mm',
-                                    date_format='mm/dd/yy')
-        report.to_excel(writer, sheet_name='Status Tracker')
+        report = pandas.DataFrame(reportRows, index=reportIndex, columns=STATUS_REPORT_COLUMNS)
+        report = report.sort_values('Days', kind='stable')
 
-        workbook = writer.book
-
-        #Write Status Report sheet
-        worksheet = writer.sheets['Status Tracker']
-
-        alertFormat = workbook.add_format({'bold':True,'font_color':'red','border':1})
-        noticeFormat = workbook.add_format({'border':3})
-
-        worksheet.set_column('F:F', 9)
-        worksheet.set_column('E:E', 9)
-        worksheet.set_column('B:B', 13)
-        worksheet.set_column('G:G', 13)
-        worksheet.set_column('H:L', 10)
-        worksheet.set_column('C:D', 4)
-        worksheet.set_column('M:M', 30)
-
-        i=0
-        for index,row in report.iterrows():
-            i+=1
-            try:
-                 days = int(row['Days'])
-            except TypeError:
-                continue
-
-            if days == 0:
-                worksheet.write(i,3, days, noticeFormat)
-            if days < 0:
-                worksheet.write(i,3, days, alertFormat)
-
-            if row['Ship By'] == '' or row['Ship By'] is None:
-                worksheet.write(i,5,row['Ship By'],noticeFormat)
-
-            staticDays, columnName, colNum = getStationDays(row)
-            if staticDays == 1:
-                try: name = row[columnName].strftime('%m/%d %H:%M')
-                except AttributeError:
-                    name = row[columnName]
-                worksheet.write(i,colNum,name, noticeFormat)
-            elif staticDays > 1:
-                try: name = row[columnName].strftime('%m/%d %H:%M')
-                except AttributeError:
-                    name = row[columnName]
-                worksheet.write(i,colNum,name, alertFormat)
-
-        ###Write Pipeline Summary
-
-        #Create sheet
-        summ = pandas.DataFrame()
-        summ.to_excel(writer, sheet_name='Summary')
-        summary = writer.sheets["Summary"]
+        ###Pipeline Summary
 
         #Count Orders
         NumItems = len(OrderList)
@@ -697,8 +2001,8 @@ FROM Orders
 WHERE OrderNumber = ?"""
         for OrderNum in OrderList:
             try:
-                self.cursor.execute(SQL, OrderNum)
-                cost = self.cursor.fetchone().ProductTotal
+                cursor.execute(SQL, OrderNum)
+                cost = cursor.fetchone().ProductTotal
                 CashFlow += cost
                 if OrderNum in LateOrderList:
                     LateCashFlow += cost
@@ -706,47 +2010,83 @@ WHERE OrderNumber = ?"""
                 print("No items found for order "+str(OrderNum))
 
         #Calculate Percentages
-        PctLateSets = NumLateSets*100/NumSets
-        PctLateItems = NumLateItems*100/NumItems
-        PctLateOrders = NumLateOrders*100/NumOrders
-        PctLateCashFlow = LateCashFlow*100/CashFlow
+        PctLateSets = percentOf(NumLateSets, NumSets)
+        PctLateItems = percentOf(NumLateItems, NumItems)
+        PctLateOrders = percentOf(NumLateOrders, NumOrders)
+        PctLateCashFlow = percentOf(LateCashFlow, CashFlow)
+
+        summary = pandas.DataFrame(
+            [[NumOrders, NumLateOrders, PctLateOrders],
+             [NumItems, NumLateItems, PctLateItems],
+             [NumSets, NumLateSets, PctLateSets],
+             [CashFlow, LateCashFlow, PctLateCashFlow]],
+            index = SUMMARY_ROWS, columns = SUMMARY_COLUMNS, dtype = object)
+        return(report, summary)
+
+    def get_status_report(self, statusList = None, filepath = "", filename = "StatusReport.xlsx",
+                          constantMemory = False):
+        report, summ = self.build_status_report(statusList)
 
+        #Write DataFrames to excel sheets
+        #Create file and workbook. Rows are written strictly in order so the
+        #workbook can be streamed to disk in constant_memory mode
+        workbook = xlsxwriter.Workbook(path.join(filepath,filename),
+                                       {'constant_memory': constantMemory})
 
-        summary.write(1,0,"Orders",alertFormat)
-        summary.write(2,0,"Items",alertFormat)
-        summary.write(3,0,"Sets",alertFormat)
-        summary.write(4,0,"Sales",alertFormat)
+        #Write Status Report sheet
+        worksheet = workbook.add_worksheet('Status Tracker')
 
-        summary.write(0,1,"Backordered",alertFormat)
-        summary.write(0,2,"Late",alertFormat)
-        summary.write(0,3,"Percent Late",alertFormat)
+        alertFormat = workbook.add_format({'bold':True,'font_color':'red','border':1})
 
-        summary.write(1,1,NumOrders)
-        summary.write(2,1,NumItems)
-        summary.write(3,1,NumSets)
-        summary.write(4,1,'$'+str("%.2f" % CashFlow))
+        worksheet.set_column('F:F', 9)
+        worksheet.set_column('E:E', 9)
+        worksheet.set_column('B:B', 13)
+        worksheet.set_column('G:G', 13)
+        worksheet.set_column('H:L', 10)
+        worksheet.set_column('C:D', 4)
+        worksheet.set_column('M:M', 30)
 
-        summary.write(1,2,NumLateOrders)
-        summary.write(2,2,NumLateItems)
-        summary.write(3,2,NumLateSets)
-        summary.write(4,2,'$'+str("%.2f" % LateCashFlow))
+        writeStatusSheet(workbook, worksheet, report)
 
-        summary.write(1,3,"%.2f" % PctLateOrders)
-        summary.write(2,3,"%.2f" % PctLateItems)
-        summary.write(3,3,"%.2f" % PctLateSets)
-        summary.write(4,3,"%.2f" % PctLateCashFlow)
+        ###Write Pipeline Summary
 
+        #Create sheet, written row by row for constant_memory mode
+        summary = workbook.add_worksheet('Summary')
         summary.set_column('B:D', 20)
 
-        writer.save()
+        for col, name in enumerate(SUMMARY_COLUMNS):
+            summary.write(0,col+1,name,alertFormat)
+
+        for row, name in enumerate(SUMMARY_ROWS):
+            backordered, late, pctLate = summ.loc[name]
+            if name == 'Sales':
+                backordered = '$'+str("%.2f" % backordered)
+                late = '$'+str("%.2f" % late)
+            summary.write(row+1,0,name,alertFormat)
+            summary.write(row+1,1,backordered)
+            summary.write(row+1,2,late)
+            summary.write(row+1,3,"%.2f" % pctLate)
+
+        workbook.close()
         return(path.join(filepath,filename))
 
+    def export_status_report(self, statusList = None, fmt = 'ndjson', filepath = "",
+                             filename = "StatusReport"):
+        #Writes the report and summary without building a workbook.
+        #Returns the report and summary file paths
+        report, summary = self.build_status_report(statusList)
+        reportPath = path.join(filepath, filename+'.'+fmt)
+        summaryPath = path.join(filepath, filename+'Summary.'+fmt)
+        writeStatusReport(report, reportPath, fmt, indexLabel = 'Line')
+        writeStatusReport(summary, summaryPath, fmt, indexLabel = 'Metric')
+        return(reportPath, summaryPath)
+
     def getSalesRecord(self, skuList, startDate=None, daysDelta=90, endDate=None):
+        cursor = self._read_cursor()
         if isinstance(skuList, str): skuList = [skuList]
         if isinstance(skuList, int): skuList = [skuList]
         salesDict = {}
         incomeDict = {}
-        rankDict = {}
         if startDate is None:
             startDate = datetime.today()
 
@@ -758,32 +2098,25 @@ WHERE OrderNumber = ?"""
             SQL = """
 SELECT QuantityShipped, QuantityReturned, PricePerUnit, CostPerUnit
 FROM "Order Details"
-WHERE SKU = ? OR SUBSTRING(SKU, 1, 5) = ?"""
+WHERE {0}"""
 
         else:
             date_params = (startDate, endDate)
             SQL = """
 SELECT QuantityShipped, QuantityReturned, PricePerUnit, CostPerUnit
 FROM "Order Details"
-WHERE (SKU = ? OR SUBSTRING(SKU, 1, 5) = ?) AND DetailDate < ? AND DetailDate > ?"""
+WHERE {0} AND DetailDate < ? AND DetailDate > ?"""
 
         total = 0
         for sku in skuList:
-            self.cursor.execute(SQL, sku, sku, *date_params)
-            quantities = self.cursor.fetchall()
+            skuClause, skuParam = skuMatchClause(sku, dialect = self.dialect)
+            cursor.execute(SQL.format(skuClause), skuParam, *date_params)
+            quantities = cursor.fetchall()
 
             skuTotal = [0,0,0]
             for quant in quantities:
-                netSale = (quant.QuantityShipped - quant.QuantityReturned)
-                try:
-                     gross = (quant.PricePerUnit) * netSale
-                except TypeError:
-                     gross = 0
-                try:
-                    net = (quant.PricePerUnit - quant.CostPerUnit) * netSale
-                except TypeError:
-                    net = 0
-
+                netSale, gross, net = lineSales(quant.QuantityShipped, quant.QuantityReturned,
+                                                quant.PricePerUnit, quant.CostPerUnit)
                 skuTotal[0] += netSale
                 skuTotal[1] += gross
                 skuTotal[2] += net
@@ -791,64 +2124,147 @@ WHERE (SKU = ? OR SUBSTRING(SKU, 1, 5) = ?) AND DetailDate < ? AND DetailDate >
             salesDict[sku] = skuTotal[0]
             incomeDict[sku] = (skuTotal[1], skuTotal[2])
 
-        #Sorting by value using lambda witchcraft
-        rankTally = 0
-        batchNum = 0
-        currentRank = "A"
-        rankLevels = {"A":0.25,
-                      "B":0.5,
-                      "C":0.75,
-                      "D":1}
-        sortedDict = [(k, salesDict[k]) for k in sorted(salesDict, key=salesDict.get, reverse=True)]
-        for sku, num in sortedDict:
-            #Computer completely filled with bees
-            if batchNum == num:
-                rankDict[sku] = currentRank
-            else:
-                batchNum = num
-                for rank in sorted(rankLevels):
-                    if rankTally <= (total*rankLevels[rank]):
-                        #print(total*rankLevels[rank])
-                        rankDict[sku] = rank
-                        currentRank = rank
-                        break
-            rankTally += num
+        rankDict = rankSales(salesDict, total)
         return(salesDict, rankDict, incomeDict)
 
-    def get_order_details(self):
+    def update_sales_rollup(self, rollup = None, refreshDays = 7):
+        #Folds Order Details lines into a SalesRollup. Only days from
+        #refreshDays before the newest line already rolled up are re-read,
+        #which also picks up recent returns and edits
+        if rollup is None:
+            rollup = SalesRollup()
+        cursor = self._read_cursor()
+        SQL = """
+SELECT SKU, DetailDate, QuantityShipped, QuantityReturned, PricePerUnit, CostPerUnit
+FROM "Order Details"
+WHERE DetailDate IS NOT NULL AND SKU IS NOT NULL{0}
+"""
+        if len(rollup) == 0:
+            cursor.execute(SQL.format(""))
+        else:
+            since = datetime.combine(rollup.lastDetailDate.date() - timedelta(days=refreshDays),
+                                     datetime.min.time())
+            rollup.clear_since(since)
+            cursor.execute(SQL.format(" AND DetailDate >= ?"), since)
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                units, gross, net = lineSales(row.QuantityShipped or 0, row.QuantityReturned or 0,
+                                              row.PricePerUnit, row.CostPerUnit)
+                rollup.add(row.SKU, row.DetailDate, units, gross, net)
+        return(rollup)
+
+    def get_station_history(self, startDate = None, chunkRows = 50000):
+        #Order Details lines with their station scan times, columns named as
+        #in the status report. QuantityNeeded and the order's Cancelled flag
+        #tell stationanalytics which unshipped lines are still in the pipeline
+        cursor = self._read_cursor()
+        SQL = """
+SELECT [Order Details].OrderNumber, [Order Details].ItemNumber, [Order Details].SKU, [Order Details].QuantityOrdered, [Order Details].QuantityNeeded, [Order Details].Status, [Order Details].DetailDate, [Order Details].Date1, [Order Details].Date2, [Order Details].Date3, [Order Details].Date4, [Order Details].Date5, [Order Details].DateShipped, Orders.Cancelled
+FROM [Order Details] LEFT JOIN Orders ON [Order Details].OrderNumber = Orders.OrderNumber
+WHERE [Order Details].Adjustment = 0{0}
+"""
+        if startDate is None:
+            cursor.execute(SQL.format(""))
+        else:
+            cursor.execute(SQL.format(" AND [Order Details].DetailDate >= ?"), startDate)
+        columns = ['OrderNumber', 'ItemNumber', 'SKU', 'QuantityOrdered', 'QuantityNeeded', 'Status',
+                   'Ordered'] + STATION_COLUMNS + ['Shipped', 'Cancelled']
+        frames = []
+        while True:
+            rows = cursor.fetchmany(chunkRows)
+            if not rows:
+                break
+            frames.append(pandas.DataFrame.from_records([tuple(row) for row in rows],
+                                                        columns=columns))
+        if not frames:
+            return(pandas.DataFrame(columns=columns))
+        return(pandas.concat(frames, ignore_index=True))
+
+    def _scan_pool(self, workers):
+        dsn = self.writeDSN if self.readPrimary else self.readDSN
+        if self.scanPool is None or self.scanPool.dsn != dsn:
+            if self.scanPool is not None:
+                self.scanPool.close()
+            self.scanPool = ConnectionPool(dsn, workers)
+        self.scanPool.size = max(self.scanPool.size, workers)
+        return(self.scanPool)
+
+    def parallel_scan(self, SQL, params = (), column = None, bounds = ((None, None),), workers = 8):
+        #Runs SQL once per (start, stop) bound, each on its own pooled
+        #connection, and yields the row lists in bound order. SQL takes the
+        #range predicate for column at {0}
+        pool = self._scan_pool(workers)
+
+        def scan(bound):
+            clause, rangeParams = rangeClause(column, *bound)
+            with pool.connection() as conn:
+                cursor = DialectCursor(conn.cursor(), self.dialect)
+                cursor.execute(SQL.format(clause), *(tuple(params) + rangeParams))
+                rows = cursor.fetchall()
+                cursor.close()
+            return(rows)
+
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for rows in executor.map(scan, bounds):
+                yield rows
+
+    def sku_bounds(self, partitions):
+        #SKU ranges of about equal line counts, split on the server's own
+        #ORDER BY SKU so partitions concatenate in server collation order
+        cursor = self._read_cursor()
+        cursor.execute('SELECT SKU, COUNT(*) AS Lines FROM "Order Details" '
+                       'WHERE SKU IS NOT NULL GROUP BY SKU ORDER BY SKU')
+        rows = cursor.fetchall()
+        return(splitBounds([row.SKU for row in rows], [row.Lines for row in rows], partitions))
+
+    def get_order_details(self, partitions = None, workers = 8):
         SQL = """
 SELECT [Order Details].SKU, [Order Details].QuantityShipped, [Order Details].QuantityReturned, [Order Details].PricePerUnit, [Order Details].CostPerUnit, [Order Details].DetailDate
 FROM [Order Details] INNER JOIN [Orders] ON ([Order Details].OrderNumber = [Orders].OrderNumber)
-WHERE [Order Details].Adjustment = 0 AND [Orders].Approved <> 0
+WHERE [Order Details].Adjustment = 0 AND [Orders].Approved <> 0{0}
 ORDER BY [Order Details].SKU
 """
 #AND ([Order Details].QuantityShipped - [Order Details].QuantityReturned) > 0
-        self.cursor.execute(SQL)
-        data = self.cursor.fetchall()
+        if partitions and not self.inTransaction:
+            #SKU ranges in server order, each sorted by the server, so joining
+            #them gives the same order as the single query
+            data = []
+            for rows in self.parallel_scan(SQL, (), '[Order Details].SKU',
+                                           self.sku_bounds(partitions), workers):
+                data.extend(rows)
+            return(data)
+        cursor = self._read_cursor()
+        cursor.execute(SQL.format(""))
+        data = cursor.fetchall()
         return(data)
 
     def get_item_status(self, orderNum, itemNum):
+        cursor = self._read_cursor()
         SQL = """
 SELECT Status
 FROM "Order Details"
 WHERE Ordernumber = ? AND ItemNumber = ?
 """
         params = (orderNum, itemNum)
-        self.cursor.execute(SQL,params)
-        data = self.cursor.fetchone()
+        cursor.execute(SQL,params)
+        data = cursor.fetchone()
         if data is None:
             data = ["CANCELLED"]
         return(str(data[0]))
 
     def order_is_cancelled(self, orderNum):
+        cursor = self._read_cursor()
         SQL = """
 SELECT Cancelled
 FROM Orders
 WHERE Ordernumber = ?
 """
         params = (orderNum)
-        self.cursor.execute(SQL,params)
-        data = self.cursor.fetchone()
+        cursor.execute(SQL,params)
+        data = cursor.fetchone()
         if data is None:
             data = [True]
         return(data[0])
@@ -859,8 +2275,9 @@ UPDATE Inventory
 SET Image = ?
 WHERE LocalSKU = ?
 """
-        self.cursor.execute(SQL, imageURL, sku)
-        self.conn.commit()
+        self._write(SQL, imageURL, sku)
+        self._emit(ImageChanged(sku, imageURL))
+        self.commit()
         return
 
     def set_secondary_image(self, sku, imageURL):
@@ -869,60 +2286,130 @@ UPDATE Inventory
 SET Text5 = ?
 WHERE LocalSKU = ?
 """
-        self.cursor.execute(SQL, imageURL, sku)
-        self.conn.commit()
+        self._write(SQL, imageURL, sku)
+        self.commit()
         return
 
     def get_sold_skus(self):
+        cursor = self._read_cursor()
         SQL = """
 SELECT DISTINCT SKU
 FROM [Order Details]
 WHERE Adjustment = 0 AND (QuantityShipped - QuantityReturned) > 0
 """
-        self.cursor.execute(SQL)
-        data = self.cursor.fetchall()
+        cursor.execute(SQL)
+        data = cursor.fetchall()
         return(data)
 
     def getOrderTotals(self):
+        cursor = self._read_cursor()
         startDate = date(2013,1,1)
-        SQL = """
-SELECT Customers.Company, Customers.PriceLevel, Customers.Text5 AS IncomeStream, [Order Details].OrderNumber, Orders.ProductTotal, Orders.Discount, Sum(Orders.ShippingTotal) AS ShippingTotal, Orders.FinalProductTotal, Orders.RevisedDiscount, Sum(Orders.FinalShippingTotal) AS FinalShippingTotal, Sum([Order Details].QuantityShipped) AS QuantityShipped, Sum([Order Details].QuantityReturned) AS QuantityReturned, Orders.OrderDate
-FROM ((Orders INNER JOIN [Order Details] ON Orders.OrderNumber = [Order Details].OrderNumber) INNER JOIN Inventory ON [Order Details].SKU = Inventory.LocalSKU) INNER JOIN Customers ON Orders.CustomerID = Customers.CustomerID
-WHERE (Orders.OrderDate>=? AND [Order Details].Adjustment=?) AND (Inventory.Category=? OR Inventory.Category=? OR Inventory.Category=? OR Inventory.Category=?)
-GROUP BY Customers.Company, Customers.PriceLevel, Customers.Text5, [Order Details].OrderNumber, Orders.ProductTotal, Orders.Discount, Orders.FinalProductTotal, Orders.RevisedDiscount, Orders.OrderDate;
-"""
+        SQL = ORDER_TOTALS_SQL.format("")
         params = (startDate, False, 'FGPN', 'Base', 'Private Label', 'MTO')
-        self.cursor.execute(SQL, params)
-        data = self.cursor.fetchall()
+        cursor.execute(SQL, params)
+        data = cursor.fetchall()
         return(data)
 
+    def update_customer_rollup(self, rollup = None, refreshDays = 31, batchSize = 500,
+                               reconcileDays = 7, reconcile = False):
+        #Re-reads only new orders, orders dated within refreshDays, and orders
+        #marked dirty (see CustomerRollup.watch); everything else stays cached.
+        #Older orders edited outside this module (returns, revised discounts,
+        #cancellations in Stone Edge) are only caught by the full re-read done
+        #every reconcileDays (None to disable) or when reconcile is True
+        if rollup is None:
+            rollup = CustomerRollup()
+        now = datetime.now()
+        dirty = set(rollup.dirty)
+        cursor = self._read_cursor()
+        startDate = date(2013,1,1)
+        params = (startDate, False, 'FGPN', 'Base', 'Private Label', 'MTO')
+
+        cursor.execute("SELECT PriceLevel, Level FROM TempPriceData")
+        rollup.priceLevels = dict((row.PriceLevel, row.Level) for row in cursor.fetchall())
+
+        full = (len(rollup) == 0 or reconcile or rollup.lastReconciled is None or
+                (reconcileDays is not None and now - rollup.lastReconciled >= timedelta(days=reconcileDays)))
+        #Dirty orders were changed by commits the replica may not have yet, so
+        #they are read from the primary, and only those are cleared. A full
+        #reconcile reads the replica and leaves them for the next refresh
+        if full:
+            batches = [("", (), False)]
+            changed = list(rollup.orders)
+            cleared = set()
+            reread = set()
+        else:
+            cutoff = datetime.combine(date.today() - timedelta(days=refreshDays),
+                                      datetime.min.time())
+            recent = [order.OrderNumber for order in rollup.orders.values()
+                      if order.OrderDate >= cutoff]
+            batches = [(" AND (Orders.OrderNumber > ? OR Orders.OrderDate >= ?)",
+                        (rollup.lastOrderNumber, cutoff), False)]
+            changed = sorted(dirty.union(recent))
+            cleared = dirty
+            reread = set(changed)
+            for i in range(0, len(changed), batchSize):
+                batch = changed[i:i+batchSize]
+                batches.append((" AND Orders.OrderNumber IN ({0})".format(', '.join('?'*len(batch))),
+                                tuple(batch), True))
+
+        rows = []
+        for condition, extra, primary in batches:
+            batchCursor = self.cursor if primary else cursor
+            batchCursor.execute(ORDER_TOTALS_SQL.format(condition), params + extra)
+            for row in batchCursor.fetchall():
+                #A re-read order comes only from its primary batch, so a stale
+                #replica copy cannot bring back a deleted or cancelled line
+                if primary or row.OrderNumber not in reread:
+                    rows.append(row)
+
+        #Only once every replacement row is in hand, so a failed read leaves
+        #the rollup as it was. Orders that no longer match (cancelled lines,
+        #deleted items) drop out
+        for orderNumber in changed:
+            rollup.remove(orderNumber)
+        rollup.dirty.difference_update(cleared)
+        for row in rows:
+            rollup.put(tuple(row))
+        if full:
+            rollup.lastReconciled = now
+        return(rollup)
+
     def getCustomerData(self):
+        cursor = self._read_cursor()
         SQL = """
 SELECT Customers.Company, TempPriceData.Level AS [PriceLevel], Customers.Text5 AS [IncomeStream], Sum(qryOrderProductQuantity.ProductTotal) AS [Gross Sale], Sum(qryOrderProductQuantity.Discount) AS [Gross Discount], Sum(qryOrderProductQuantity.SumOfShippingTotal) AS [Gross Shipping], Sum(qryOrderProductQuantity.FinalProductTotal) AS [Net Sale], Sum(qryOrderProductQuantity.RevisedDiscount) AS [Net Discount], Sum(qryOrderProductQuantity.SumOfFinalShippingTotal) AS [Net Shipping], Sum(qryOrderProductQuantity.SumOfQuantityShipped) AS QuantityShipped, Sum(qryOrderProductQuantity.SumOfQuantityReturned) AS QuantityReturned
 FROM (Customers LEFT JOIN TempPriceData ON Customers.PriceLevel = TempPriceData.PriceLevel) RIGHT JOIN qryOrderProductQuantity ON Customers.CustomerID = qryOrderProductQuantity.CustomerID
-WHERE (((qryOrderProductQuantity.OrderDate)>=#1/1/2013#))
+WHERE (((qryOrderProductQuantity.OrderDate)>=?))
 GROUP BY Customers.Company, TempPriceData.Level, Customers.Text5
 HAVING (((Sum(qryOrderProductQuantity.SumOfQuantityShipped))>0));
 """
-        self.cursor.execute(SQL)
-        data = self.cursor.fetchall()
+        cursor.execute(SQL, datetime(2013, 1, 1))
+        data = cursor.fetchall()
         return(data)
 
-    def getCustomerOrderItems(self, startTime, endTime):
-        SQL = """
-SELECT Customers.PriceLevel, Orders.OrderDate, [Order Details].SKU, [Order Details].PricePerUnit, Customers.CustomerID, [Order Details].OrderNumber
-FROM (Orders INNER JOIN Customers ON Orders.CustomerID = Customers.CustomerID) INNER JOIN [Order Details] ON Orders.OrderNumber = [Order Details].OrderNumber
-WHERE (Customers.PriceLevel>0 AND Orders.OrderDate<=? AND Orders.OrderDate>? AND (([Order Details].Adjustment)=0));
-"""
-        params = (startTime, endTime)
-        self.cursor.execute(SQL, params)
-        data = self.cursor.fetchall()
+    def getCustomerOrderItems(self, startTime, endTime, partitions = None, workers = 8):
+        if partitions and not self.inTransaction:
+            data = []
+            for rows in self.customer_order_item_partitions(startTime, endTime, partitions, workers):
+                data.extend(rows)
+            return(data)
+        cursor = self._read_cursor()
+        cursor.execute(CUSTOMER_ORDER_ITEMS_SQL.format(""), startTime, endTime)
+        data = cursor.fetchall()
         return(data)
 
-if __name__ == '__main__':
+    def customer_order_item_partitions(self, startTime, endTime, partitions = 8, workers = 8):
+        #Split the OrderDate window; the outer bounds stay in the WHERE.
+        #Yields each partition's rows as its scan finishes, in date order
+        return(self.parallel_scan(CUSTOMER_ORDER_ITEMS_SQL, (startTime, endTime), 'Orders.OrderDate',
+                                  partitionBounds(endTime, startTime, partitions), workers))
 
-    with Database('BOT') as db:
-        print(db.order_is_cancelled("1001"))
-        print('"{0}"'.format(db.get_item_status("1001","02")))
-        input("")
-        print('Databaseutils')
+    def scan_customer_order_items(self, startTime, endTime, partitions = 8, workers = 8):
+        #Columnar form of a partitioned getCustomerOrderItems, one frame per
+        #partition as it arrives, so the full row list is never held at once
+        return(rowsToFrame(self.customer_order_item_partitions(startTime, endTime, partitions, workers),
+                           CUSTOMER_ORDER_ITEM_COLUMNS))
+
+if __name__ == '__main__':
+    main()
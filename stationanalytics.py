@@ -0,0 +1,175 @@
+# Station throughput and dwell-time analytics over Order Details Date1-Date5
+# Works on the DataFrame returned by Database.get_station_history
+
+import numpy as np
+import pandas
+from datetime import datetime
+
+from databaseutils import STATION_COLUMNS, workDaysDiffArray
+
+#'Ordered' is the wait between the order line being created and its first scan
+STAGES = ['Ordered'] + STATION_COLUMNS
+NOT_SCANNED = np.iinfo(np.int64).max
+
+
+def toNanoseconds(column):
+    column = pandas.to_datetime(column).to_numpy(dtype='datetime64[ns]')
+    return(np.where(np.isnat(column), NOT_SCANNED, column.astype(np.int64)))
+
+
+def toDays(nanoseconds):
+    return(nanoseconds.astype('datetime64[ns]').astype('datetime64[D]'))
+
+
+def pendingLines(history):
+    #Still in the pipeline as the status report counts it: QuantityNeeded > 0
+    #on an order that is not cancelled. Without those columns every line is
+    if 'QuantityNeeded' not in history:
+        return(np.ones(len(history), dtype=bool))
+    pending = pandas.to_numeric(history['QuantityNeeded'], errors='coerce').fillna(0).to_numpy() > 0
+    if 'Cancelled' in history:
+        pending &= ~history['Cancelled'].fillna(False).astype(bool).to_numpy()
+    return(pending)
+
+
+def stageTimes(history):
+    #Returns (times, exits), both lines x stages int64 nanoseconds with
+    #NOT_SCANNED where there is no value. A line leaves a stage at its next
+    #later scan at any station, or when it shipped, which copes with skipped
+    #stations and out of order rescans. Lines no longer pending (cancelled,
+    #or closed without a ship date) leave their last stage at its scan
+    times = np.empty((len(history), len(STAGES)), dtype=np.int64)
+    for i, stage in enumerate(STAGES):
+        times[:, i] = toNanoseconds(history[stage])
+    if 'Shipped' in history:
+        shipped = toNanoseconds(history['Shipped'])
+    else:
+        shipped = np.full(len(history), NOT_SCANNED, dtype=np.int64)
+
+    candidates = np.column_stack([times, shipped])
+    exits = np.empty(times.shape, dtype=np.int64)
+    for i in range(len(STAGES)):
+        later = np.where(candidates > times[:, i:i+1], candidates, NOT_SCANNED)
+        exits[:, i] = later.min(axis=1)
+    exits[times == NOT_SCANNED] = NOT_SCANNED
+    closed = ~pendingLines(history)[:, None] & (times != NOT_SCANNED) & (exits == NOT_SCANNED)
+    exits[closed] = times[closed]
+    return(times, exits)
+
+
+def dayRange(times, exits = None, today = None):
+    #Covers every scan and exit, shipping included, through at least today
+    if today is None:
+        today = datetime.now().date()
+    last = np.datetime64(today, 'D')
+    if exits is not None:
+        times = np.concatenate([times.ravel(), exits.ravel()])
+    scanned = times[times != NOT_SCANNED]
+    if len(scanned) == 0:
+        return(pandas.date_range(last, last, freq='D'))
+    return(pandas.date_range(toDays(scanned.min()), max(last, toDays(scanned.max())), freq='D'))
+
+
+def lineWeights(history, weights):
+    if weights is None:
+        return(np.ones(len(history)))
+    if isinstance(weights, str):
+        weights = history[weights]
+    return(np.asarray(weights, dtype=np.float64))
+
+
+def _dwell(history, times, exits, today):
+    if today is None:
+        today = datetime.now().date()
+    reached = times != NOT_SCANNED
+    isOpen = reached & (exits == NOT_SCANNED)
+    arrivalDays = toDays(np.where(reached, times, 0))
+    exitDays = np.where(isOpen, np.datetime64(today, 'D'),
+                        toDays(np.where(exits == NOT_SCANNED, 0, exits)))
+    dwell = workDaysDiffArray(arrivalDays, exitDays).astype(np.float64)
+    dwell[~reached] = np.nan
+    return(pandas.DataFrame(dwell, index=history.index, columns=STAGES),
+           pandas.DataFrame(isOpen, index=history.index, columns=STAGES))
+
+
+def _queueDepth(times, exits, days, weights):
+    first = days[0].to_datetime64().astype('datetime64[D]')
+    numDays = len(days)
+    depth = {}
+    for i, stage in enumerate(STAGES):
+        reached = times[:, i] != NOT_SCANNED
+        arrive = (toDays(times[reached, i]) - first).astype(np.int64)
+        change = np.bincount(arrive, weights=weights[reached], minlength=numDays+1)
+        left = reached & (exits[:, i] != NOT_SCANNED)
+        leave = (toDays(exits[left, i]) - first).astype(np.int64)
+        change -= np.bincount(leave, weights=weights[left], minlength=numDays+1)
+        depth[stage] = np.cumsum(change[:numDays])
+    return(pandas.DataFrame(depth, index=days, columns=STAGES))
+
+
+def _throughput(times, exits, days, weights):
+    first = days[0].to_datetime64().astype('datetime64[D]')
+    numDays = len(days)
+    done = {}
+    for i, stage in enumerate(STAGES):
+        left = exits[:, i] != NOT_SCANNED
+        leave = (toDays(exits[left, i]) - first).astype(np.int64)
+        done[stage] = np.bincount(leave, weights=weights[left], minlength=numDays)[:numDays]
+    return(pandas.DataFrame(done, index=days, columns=STAGES))
+
+
+def dwellTimes(history, today = None):
+    #Work days (workDaysDiff semantics) each line spent at each stage.
+    #Returns (dwell, isOpen): NaN where the line never reached the stage,
+    #isOpen marks lines still sitting at that stage, measured up to today
+    times, exits = stageTimes(history)
+    return(_dwell(history, times, exits, today))
+
+
+def queueDepth(history, today = None, weights = None):
+    #Lines (or a weight column such as 'QuantityOrdered') sitting at each
+    #stage at the end of every calendar day
+    times, exits = stageTimes(history)
+    return(_queueDepth(times, exits, dayRange(times, exits, today), lineWeights(history, weights)))
+
+
+def throughput(history, today = None, weights = None):
+    #Lines (or weights) leaving each stage per calendar day
+    times, exits = stageTimes(history)
+    return(_throughput(times, exits, dayRange(times, exits, today), lineWeights(history, weights)))
+
+
+def bottlenecks(history, today = None, weights = None, workDaysOnly = True):
+    #Per stage summary. Wait Days is Little's law, average queue over average
+    #daily throughput; the stage with the longest wait is the bottleneck
+    times, exits = stageTimes(history)
+    days = dayRange(times, exits, today)
+    weights = lineWeights(history, weights)
+    dwell, isOpen = _dwell(history, times, exits, today)
+    depth = _queueDepth(times, exits, days, weights)
+    done = _throughput(times, exits, days, weights)
+    if workDaysOnly:
+        workDays = depth.index.dayofweek < 5
+        depth = depth[workDays]
+        done = done[workDays]
+
+    summary = pandas.DataFrame(index=STAGES)
+    summary['Lines'] = dwell.notna().sum()
+    summary['Open'] = isOpen.sum()
+    summary['Mean Dwell'] = dwell.mean()
+    summary['Median Dwell'] = dwell.median()
+    summary['P90 Dwell'] = dwell.quantile(0.9)
+    summary['Mean Queue'] = depth.mean()
+    summary['Max Queue'] = depth.max()
+    summary['Throughput/Day'] = done.mean()
+    summary['Wait Days'] = summary['Mean Queue'] / summary['Throughput/Day'].replace(0, np.nan)
+    summary['Bottleneck'] = False
+    if summary['Wait Days'].notna().any():
+        summary.loc[summary['Wait Days'].idxmax(), 'Bottleneck'] = True
+    return(summary)
+
+
+def dailyBottleneck(history, today = None, weights = None):
+    #The station with the deepest queue at the end of each day
+    stations = queueDepth(history, today, weights)[STATION_COLUMNS]
+    return(stations.idxmax(axis=1).where(stations.max(axis=1) > 0))
@@ -0,0 +1,103 @@
+# Read/write routing checks against two local SQLite files. The replica file
+# is never written to, so it behaves like a replica that has not caught up
+# Needs pyodbc and the SQLite3 ODBC driver; skipped when either is missing
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import pyodbc
+    import databaseutils
+    from databaseutils import Database, SQLITE_DB
+    HAVE_DRIVER = 'SQLite3 ODBC Driver' in pyodbc.drivers()
+except ImportError:
+    HAVE_DRIVER = False
+
+SCHEMA = """
+CREATE TABLE Inventory (LocalSKU TEXT PRIMARY KEY, Discontinued INTEGER, Category TEXT, QOH INTEGER);
+CREATE TABLE "Order Details" (OrderNumber INTEGER, ItemNumber INTEGER, SKU TEXT, Status TEXT,
+                              Adjustment INTEGER, QuantityShipped INTEGER, QuantityReturned INTEGER);
+CREATE TABLE Orders (OrderNumber INTEGER, CustomerID INTEGER, OrderDate TIMESTAMP, ProductTotal REAL,
+                     Discount REAL, ShippingTotal REAL, FinalProductTotal REAL, RevisedDiscount REAL,
+                     FinalShippingTotal REAL);
+CREATE TABLE Customers (CustomerID INTEGER, Company TEXT, PriceLevel INTEGER, Text5 TEXT);
+CREATE TABLE TempPriceData (PriceLevel INTEGER, Level TEXT);
+INSERT INTO Inventory VALUES ('ABCDE-1', 0, 'FGPN', 3);
+INSERT INTO Inventory VALUES ('ABCDE-2', 0, 'FGPN', 5);
+INSERT INTO "Order Details" VALUES (1001, 1, 'ABCDE-1', 'Engraving', 0, 2, 0);
+INSERT INTO "Order Details" VALUES (1001, 2, 'ABCDE-2', 'Engraving', 0, 3, 0);
+INSERT INTO Orders VALUES (1001, 1, '2020-01-06 00:00:00', 50.0, 0, 5.0, 50.0, 0, 5.0);
+INSERT INTO Customers VALUES (1, 'Acme', 1, 'Wholesale');
+INSERT INTO TempPriceData VALUES (1, 'Dealer');
+"""
+
+
+@unittest.skipUnless(HAVE_DRIVER, 'pyodbc with the SQLite3 ODBC Driver is required')
+class RoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.primary = os.path.join(self.folder, 'primary.db')
+        self.replica = os.path.join(self.folder, 'replica.db')
+        conn = sqlite3.connect(self.primary)
+        conn.executescript(SCHEMA)
+        conn.commit()
+        conn.close()
+        shutil.copy(self.primary, self.replica)
+        self.db = Database('TEST', writeDSN = SQLITE_DB + self.primary,
+                           readDSN = SQLITE_DB + self.replica)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.folder)
+
+    def test_lookups_use_replica(self):
+        self.db.update_inventory('ABCDE-1', {'QOH': 7})
+        self.db.commit()
+        self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 3)
+
+    def test_open_transaction_reads_primary(self):
+        self.db.update_inventory('ABCDE-1', {'QOH': 7})
+        self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 7)
+        self.db.commit()
+        self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 3)
+
+    def test_primary_reads(self):
+        self.db.update_inventory('ABCDE-1', {'QOH': 7})
+        self.db.commit()
+        with self.db.primary_reads():
+            self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 7)
+        self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 3)
+
+    def test_read_primary_flag(self):
+        self.db.readPrimary = True
+        self.db.update_inventory('ABCDE-1', {'QOH': 7})
+        self.db.commit()
+        self.assertEqual(self.db.get_inventory_row('ABCDE-1').QOH, 7)
+
+    def test_stale_catalog_refresh_reads_primary(self):
+        self.db.get_sku_lists()
+        self.db.update_inventory('ABCDE-1', {'Discontinued': 1})
+        self.db.commit()
+        catalog = self.db.get_sku_catalog()
+        self.assertTrue(catalog.is_discontinued('ABCDE-1'))
+        self.assertFalse(catalog.stale)
+
+    def test_dirty_orders_reread_from_primary(self):
+        rollup = self.db.update_customer_rollup()
+        self.assertEqual(rollup.orders[1001].QuantityShipped, 5)
+        rollup.watch(self.db.eventBus)
+        self.db.delete_item(1001, 2)
+        self.db.commit()
+        self.db.update_customer_rollup(rollup)
+        self.assertEqual(rollup.orders[1001].QuantityShipped, 2)
+        self.assertFalse(rollup.dirty)
+
+
+if __name__ == '__main__':
+    unittest.main()